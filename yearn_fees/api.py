@@ -0,0 +1,259 @@
+"""
+A read-only json api over the indexed reports.
+
+    GET /reports?vault=&strategy=&version=&start=&end=&after=&limit=
+    GET /reports/<block_number>/<log_index>
+    GET /fees/<vault|strategy|version>/<key>?grain=day&start=&end=
+
+Reports are paged by a cursor on (block_number, log_index), pass `next` from a response
+as `after` to get the next page. Fee aggregates are read from the rollup tables.
+Responses are cached in memory, the indexer sends a `reports` notification with each insert
+and the cache is cleared when it arrives.
+"""
+
+import json
+import select as select_fd
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import Dict
+from urllib.parse import parse_qs, urlparse
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from yearn_fees import rollups
+from yearn_fees.models import FeeRollup, Report, connection_params, db_session, select
+
+CHANNEL = "reports"
+MAX_LIMIT = 1000
+CACHE_SIZE = 10_000
+RECONNECT_DELAY = 5
+
+
+class NotFound(Exception):
+    pass
+
+
+class ResponseCache:
+    """
+    An lru cache of encoded responses which is cleared when new reports are inserted.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        # bumped on clear, so a response read before an insert is not stored after it
+        self.generation = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.items[key] = value
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.items.clear()
+
+
+def listen(cache: ResponseCache):
+    """
+    Clear the cache on each `reports` notification, reconnecting if the connection drops.
+    """
+    params = connection_params()
+    params["dbname"] = params.pop("database")
+
+    while True:
+        try:
+            conn = psycopg2.connect(**params)
+        except psycopg2.Error:
+            sleep(RECONNECT_DELAY)
+            continue
+
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"listen {CHANNEL}")
+            # notifications sent while disconnected are lost
+            cache.clear()
+            while True:
+                if select_fd.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    cache.clear()
+        except (psycopg2.Error, OSError):
+            sleep(RECONNECT_DELAY)
+        finally:
+            conn.close()
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # keep the full precision
+        return str(value)
+    raise TypeError(type(value))
+
+
+def parse_date(value):
+    if not value:
+        return None
+    # dates without an offset are in utc
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        return date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc)
+
+
+def report_dict(report: Report) -> Dict:
+    """
+    A report with the derived fees of `types.Fees`.
+    """
+    data = report.to_dict()
+    data["governance_fee"] = report.management_fee + report.performance_fee
+    data["total_fee"] = data["governance_fee"] + report.strategist_fee
+    return data
+
+
+def get_reports(params) -> Dict:
+    limit = int(params.get("limit", 100))
+    if limit < 1:
+        raise ValueError("invalid limit", limit)
+    limit = min(limit, MAX_LIMIT)
+    query = select(r for r in Report)
+    if "vault" in params:
+        vault = params["vault"]
+        query = query.filter(lambda r: r.vault == vault)
+    if "strategy" in params:
+        strategy = params["strategy"]
+        query = query.filter(lambda r: r.strategy == strategy)
+    if "version" in params:
+        version = params["version"]
+        query = query.filter(lambda r: r.version == version)
+    if "start" in params:
+        start = parse_date(params["start"])
+        query = query.filter(lambda r: r.timestamp >= start)
+    if "end" in params:
+        end = parse_date(params["end"])
+        query = query.filter(lambda r: r.timestamp < end)
+    if "after" in params:
+        block_number, log_index = map(int, params["after"].split(":"))
+        query = query.filter(
+            lambda r: r.block_number > block_number
+            or (r.block_number == block_number and r.log_index > log_index)
+        )
+
+    # fetch one more row to know if there is a next page
+    rows = list(query.order_by(Report.block_number, Report.log_index).limit(limit + 1))
+    page = rows[:limit]
+    cursor = f"{page[-1].block_number}:{page[-1].log_index}" if len(rows) > limit else None
+    return {"data": [report_dict(row) for row in page], "next": cursor}
+
+
+def get_report(block_number, log_index) -> Dict:
+    report = Report.get(block_number=int(block_number), log_index=int(log_index))
+    if report is None:
+        raise NotFound()
+    return report_dict(report)
+
+
+def get_fees(scope, key, params) -> Dict:
+    if scope not in rollups.SCOPES:
+        raise NotFound()
+    grain = params.get("grain", "day")
+    if grain not in rollups.GRAINS:
+        raise ValueError("invalid grain", grain)
+
+    query = select(r for r in FeeRollup if r.scope == scope and r.key == key and r.grain == grain)
+    if "start" in params:
+        start = parse_date(params["start"])
+        query = query.filter(lambda r: r.period >= start)
+    if "end" in params:
+        end = parse_date(params["end"])
+        query = query.filter(lambda r: r.period < end)
+
+    periods = []
+    total = {"reports": 0, "duration": 0, **{amount: Decimal(0) for amount in rollups.AMOUNTS}}
+    for row in query.order_by(FeeRollup.period):
+        item = row.to_dict(exclude=["scope", "key", "grain"])
+        item["governance_fee"] = row.management_fee + row.performance_fee
+        item["total_fee"] = item["governance_fee"] + row.strategist_fee
+        periods.append(item)
+        for name in total:
+            total[name] += item[name]
+
+    total["governance_fee"] = total["management_fee"] + total["performance_fee"]
+    total["total_fee"] = total["governance_fee"] + total["strategist_fee"]
+    return {"scope": scope, "key": key, "grain": grain, "periods": periods, "total": total}
+
+
+def route(path, params) -> Dict:
+    parts = path.strip("/").split("/")
+    with db_session:
+        if parts == ["reports"]:
+            return get_reports(params)
+        if len(parts) == 3 and parts[0] == "reports":
+            return get_report(parts[1], parts[2])
+        if len(parts) == 3 and parts[0] == "fees":
+            return get_fees(parts[1], parts[2], params)
+
+    raise NotFound()
+
+
+def serve(host="127.0.0.1", port=8000, cache_size=CACHE_SIZE):
+    cache = ResponseCache(cache_size)
+    threading.Thread(target=listen, args=(cache,), daemon=True).start()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            # repeated queries with reordered params share an entry
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            key = (url.path, tuple(sorted(params.items())))
+            body = cache.get(key)
+            if body is None:
+                generation = cache.generation
+                try:
+                    body = json.dumps(route(url.path, params), default=encode).encode()
+                except NotFound:
+                    self.send_error(404)
+                    return
+                except ValueError as e:
+                    self.send_error(400, repr(e))
+                    return
+                cache.set(key, body, generation)
+
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server, cache
@@ -0,0 +1,166 @@
+"""
+A self-contained archive of everything the pipeline reads from a node.
+
+`yearn-fees export-archive <path>` writes it once, after that `yearn-fees --offline <path>`
+makes all `utils` lookups and assessment state reads come from the archive.
+
+- `meta.pickle.gz` holds the global lookups: reports, vaults, decimals, fee histories,
+  lifecycle events and block timestamps
+- `txs.bin` holds a gzipped pickle per tx with its reports, assessment state and split traces,
+  it's memory-mapped and indexed by tx hash in `txs.json`
+"""
+
+import gzip
+import json
+import mmap
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, wraps
+from pathlib import Path
+from typing import Dict, List, Optional
+
+OFFLINE_ENV = "YEARN_FEES_OFFLINE"
+
+
+class Archive:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = pickle.loads(gzip.decompress((self.path / "meta.pickle.gz").read_bytes()))
+        self.index = json.loads((self.path / "txs.json").read_text())
+        with open(self.path / "txs.bin", "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @lru_cache(maxsize=256)
+    def tx(self, tx) -> Dict:
+        if isinstance(tx, bytes):
+            tx = tx.hex()
+        if tx not in self.index:
+            raise KeyError("tx is not archived", tx)
+
+        offset, length = self.index[tx]
+        return pickle.loads(gzip.decompress(self.data[offset : offset + length]))
+
+    def assessment_state(self, report) -> Dict:
+        return self.tx(report.transaction_hash.hex())["assessment_state"][report.log_index]
+
+    def split_trace(self, tx) -> List:
+        traces = self.tx(tx)["traces"]
+        if traces is None:
+            raise ValueError("tx was archived without traces", tx)
+
+        return traces
+
+
+@lru_cache(maxsize=None)
+def open_archive(path) -> Archive:
+    return Archive(path)
+
+
+def get_archive() -> Optional[Archive]:
+    """
+    The archive in offline mode, read from the environment so dask workers inherit it.
+    """
+    path = os.environ.get(OFFLINE_ENV)
+    return open_archive(path) if path else None
+
+
+def offline(lookup):
+    """
+    In offline mode, replace a node lookup with `lookup(archive, *args, **kwargs)`.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            archive = get_archive()
+            if archive is None:
+                return func(*args, **kwargs)
+            return lookup(archive, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def export_tx(tx, include_traces=True) -> Dict:
+    from yearn_fees import assess, utils
+
+    reports = utils.reports_from_tx(tx)
+    return {
+        "reports": reports,
+        "assessment_state": {
+            report.log_index: assess.assessment_state(report) for report in reports
+        },
+        "traces": utils.get_split_trace(tx) if include_traces else None,
+    }
+
+
+def export_meta(txs, workers=4) -> Dict:
+    from ape import chain
+    from rich.progress import track
+
+    from yearn_fees import node, utils
+
+    node.connect()
+    reports = utils.get_reports()
+    exported = [report for report in reports if report.transaction_hash.hex() in txs]
+    vaults = sorted({report.contract_address for report in exported})
+    first_reports = {}
+    for report in exported:
+        first_reports.setdefault((report.contract_address, report.strategy), report)
+
+    lifecycle = {
+        key: utils.get_lifecycle_history(report)
+        for key, report in track(first_reports.items(), description="lifecycle")
+    }
+    blocks = {report.block_number for report in exported}
+    blocks |= {log.block_number for history in lifecycle.values() for log in history.values()}
+    with ThreadPoolExecutor(workers) as pool:
+        timestamps = dict(
+            zip(blocks, pool.map(lambda block: chain.blocks[block].timestamp, blocks))
+        )
+
+    return {
+        "height": chain.blocks.height,
+        "vaults_by_version": utils.get_vaults_by_version(),
+        "reports": reports,
+        "versions": {
+            report.contract_address: utils.version_from_report(report) for report in exported
+        },
+        "decimals": {vault: utils.get_decimals(vault) for vault in vaults},
+        "fee_histories": utils.get_fee_histories(),
+        "lifecycle": lifecycle,
+        "timestamps": timestamps,
+    }
+
+
+def export(path, txs=None, include_traces=True, workers=4) -> Path:
+    """
+    Write an archive of `txs`, or of all txs with reports.
+    """
+    from rich.progress import track
+    from toolz import unique
+
+    from yearn_fees import utils
+
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    if txs is None:
+        txs = list(unique(report.transaction_hash.hex() for report in utils.get_reports()))
+
+    index = {}
+    offset = 0
+    with ThreadPoolExecutor(workers) as pool, open(path / "txs.bin", "wb") as f:
+        tasks = {pool.submit(export_tx, tx, include_traces): tx for tx in txs}
+        for future in track(as_completed(tasks), total=len(tasks), description="export txs"):
+            data = gzip.compress(pickle.dumps(future.result()))
+            f.write(data)
+            index[tasks[future]] = [offset, len(data)]
+            offset += len(data)
+
+    (path / "txs.json").write_text(json.dumps(index))
+    meta = export_meta(set(txs), workers)
+    (path / "meta.pickle.gz").write_bytes(gzip.compress(pickle.dumps(meta)))
+
+    return path
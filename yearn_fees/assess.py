@@ -1,19 +1,26 @@
+from typing import Dict, Optional
+
 from ape import Contract
 from ape.contracts import ContractLog
 from rich import print
 from semantic_version import Version
 
+from yearn_fees import archive, node
+from yearn_fees.profiling import profile
 from yearn_fees.types import Fees
 from yearn_fees.utils import (
+    get_decimals,
     get_fee_config_at_report,
     reports_from_block,
     version_from_report,
 )
 
 
-def assess_fees(report: ContractLog) -> Fees:
+@archive.offline(lambda archive, report: archive.assessment_state(report))
+@node.needs_node
+def assessment_state(report: ContractLog) -> Dict[str, Optional[int]]:
     """
-    A reimplementation of Vault._assessFees which supports all api versions.
+    Read the vault and strategy state _assessFees depends on.
     """
     vault = Contract(report.contract_address)
     strategy = Contract(report.strategy)
@@ -44,13 +51,7 @@ def assess_fees(report: ContractLog) -> Fees:
     # 0.4.0 no fees are charged if there was no gain
     if version >= Version("0.4.0"):
         if report.gain == 0:
-            return Fees(duration=duration)
-
-    # 0.3.3 year changed from 365.25 to 365.2425 days
-    if version >= Version("0.3.3"):
-        SECS_PER_YEAR = 31_556_952
-    else:
-        SECS_PER_YEAR = 31_557_600
+            return {"duration": duration, "total_assets": None}
 
     # 0.3.5 read total debt and delegated assets from strategy
     if version >= Version("0.3.5"):
@@ -80,12 +81,36 @@ def assess_fees(report: ContractLog) -> Fees:
     else:
         raise ValueError("invalid version %s", version)
 
+    return {"duration": duration, "total_assets": total_assets}
+
+
+@profile(lambda report: report.transaction_hash.hex())
+def assess_fees(report: ContractLog) -> Fees:
+    """
+    A reimplementation of Vault._assessFees which supports all api versions.
+    """
+    version = Version(version_from_report(report))
+    state = assessment_state(report)
+    duration = state["duration"]
+
+    # 0.4.0 no fees are charged if there was no gain
+    if version >= Version("0.4.0"):
+        if report.gain == 0:
+            return Fees(duration=duration)
+
+    # 0.3.3 year changed from 365.25 to 365.2425 days
+    if version >= Version("0.3.3"):
+        SECS_PER_YEAR = 31_556_952
+    else:
+        SECS_PER_YEAR = 31_557_600
+
+    total_assets = state["total_assets"]
     MAX_BPS = 10_000
     conf = get_fee_config_at_report(report)
 
     # 0.3.5 is the only verison that uses a precision factor
     if version == Version("0.3.5"):
-        prec = 10 ** (18 - vault.decimals())
+        prec = 10 ** (18 - get_decimals(report.contract_address))
     else:
         prec = 1
 
@@ -0,0 +1,467 @@
+"""
+Offline benchmarks for the trace pipeline.
+
+Fixtures are recorded once from a node with `yearn-fees benchmark record <tx>`, after that
+`yearn-fees benchmark run` needs no network. A generated fixture per extraction style is written
+on the first run, so a fresh checkout always has cases to compare.
+
+Each case runs in a fresh process. `ru_maxrss` is a process-lifetime peak, so peak rss growth is
+how far a component raises it above what loading the fixture already took, and it reads zero for
+a component which stays below that. Results are appended to `benchmarks/results.jsonl` together
+with the git commit, use `yearn-fees benchmark compare` to spot regressions.
+"""
+
+import gzip
+import json
+import multiprocessing
+import random
+import resource
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from itertools import chain as concat
+from itertools import cycle, islice, repeat
+from pathlib import Path
+from time import perf_counter, time
+from typing import Dict, List
+
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+BENCHMARKS = Path("benchmarks")
+FIXTURES = BENCHMARKS / "fixtures"
+RESULTS = BENCHMARKS / "results.jsonl"
+STARTUP_RESULTS = BENCHMARKS / "startup.jsonl"
+SYNTHETIC_FRAMES = [1_000_000, 5_000_000, 20_000_000]
+# one version per extraction plan shape, see traces.EXTRACTION_PLANS
+GENERATED_VERSIONS = ["0.3.0", "0.3.3", "0.3.5", "0.4.2", "0.4.3"]
+GENERATED_REPORTS = 2
+STARTUP_COMMANDS = ["--help", "layout --help", "verification-stats --help"]
+
+
+def record_fixture(tx, vmtrace=False) -> Path:
+    """
+    Record the raw structLogs of a tx and the metadata needed to split it.
+    """
+    from ape import chain
+
+    from yearn_fees import node, traces, utils
+
+    node.connect()
+    reports = utils.reports_from_tx(tx)
+    metadata = [traces.ReportMetadata.from_report(report) for report in reports]
+    struct_logs = list(
+        chain.provider.stream_request("debug_traceTransaction", [tx], "result.structLogs.item")
+    )
+    version = metadata[0].version
+    fixture = {
+        "tx": tx,
+        "reports": [
+            {"version": meta.version, "topic": meta.topic, "jumpdest": meta.jumpdest}
+            for meta in metadata
+        ],
+        "struct_logs": struct_logs,
+    }
+
+    path = FIXTURES / version / f"{tx}.json.gz"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(gzip.compress(json.dumps(fixture).encode()))
+
+    if vmtrace:
+        result = chain.provider._make_request("trace_replayTransaction", [tx, ["vmTrace"]])
+        vm_path = path.with_name(f"{tx}.vmtrace.json.gz")
+        vm_path.write_bytes(gzip.compress(json.dumps(result["vmTrace"]).encode()))
+
+    return path
+
+
+def word(value) -> str:
+    return f"{value:064x}"
+
+
+def generate_fixture(version, seed=0) -> Dict:
+    """
+    A deterministic stand-in for a recorded harvest tx with `GENERATED_REPORTS` reports.
+
+    Each report enters `_assessFees` at its jumpdest, passes every program counter of the
+    version with the fee values in their memory slots and ends with a StrategyReported log.
+    Frames in between use program counters below any of the splits.
+    """
+    from yearn_fees.memory_layout import MEMORY_LAYOUT, PROGRAM_COUNTERS
+
+    rng = random.Random(f"{version}-{seed}")
+    layout = MEMORY_LAYOUT[version]["_assessFees"]
+    jumpdest, *pcs = PROGRAM_COUNTERS[version]
+    ops = ["PUSH1", "DUP2", "SWAP1", "MLOAD", "MSTORE", "ADD", "JUMP", "JUMPI", "SLOAD"]
+    topic = rng.getrandbits(256)
+    struct_logs = []
+
+    def frame(pc, op, stack, memory):
+        struct_logs.append(
+            {
+                "pc": pc,
+                "op": op,
+                "gas": 1_000_000 - len(struct_logs),
+                "gasCost": 3,
+                "depth": 1,
+                "stack": [hex(value) for value in stack],
+                "memory": [word(value) for value in memory],
+            }
+        )
+
+    def filler(num, memory):
+        for _ in range(num):
+            stack = [rng.getrandbits(160) for _ in range(rng.randint(1, 8))]
+            frame(rng.randrange(10_000), rng.choice(ops), stack, memory)
+
+    for _ in range(GENERATED_REPORTS):
+        filler(10_000, [rng.getrandbits(256) for _ in range(4)])
+
+        gain = rng.randrange(10**18, 10**24)
+        fees = {
+            "gain": gain,
+            "duration": rng.randrange(3_600, 30 * 86_400),
+            "management_fee": gain // 100,
+            "performance_fee": gain // 10,
+            "strategist_fee": gain // 10,
+        }
+        fees["governance_fee"] = fees["management_fee"] + fees["performance_fee"]
+        fees["total_fee"] = fees["governance_fee"] + fees["strategist_fee"]
+        memory = [rng.getrandbits(64) for _ in range(max(layout.values()) + 2)]
+        for name, pos in layout.items():
+            memory[pos] = fees.get(name, memory[pos])
+
+        frame(jumpdest, "JUMPDEST", [jumpdest], memory)
+        for pc in sorted(pcs):
+            filler(40, memory)
+            frame(pc, rng.choice(ops), [rng.getrandbits(64)], memory)
+        frame(rng.randrange(10_000), "LOG2", [topic, 96, 0], memory)
+
+    return {
+        "tx": "generated",
+        "reports": [{"version": version, "topic": topic, "jumpdest": jumpdest}] * GENERATED_REPORTS,
+        "struct_logs": struct_logs,
+    }
+
+
+def generate_fixtures(versions=GENERATED_VERSIONS) -> List[Path]:
+    """
+    Write the generated fixtures which are missing, they don't change between runs.
+    """
+    paths = []
+    for version in versions:
+        path = FIXTURES / version / "generated.json.gz"
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fixture = json.dumps(generate_fixture(version)).encode()
+            path.write_bytes(gzip.compress(fixture, mtime=0))
+        paths.append(path)
+
+    return paths
+
+
+def load_fixture(path: Path) -> Dict:
+    return json.loads(gzip.decompress(path.read_bytes()))
+
+
+def fixture_metadata(fixture):
+    from yearn_fees.traces import ReportMetadata
+
+    return [
+        ReportMetadata(vault=None, version=r["version"], topic=r["topic"], jumpdest=r["jumpdest"])
+        for r in fixture["reports"]
+    ]
+
+
+def synthetic_frames(frames, num_frames):
+    """
+    Scale up parsed fixture frames by padding them with frames which never match a split.
+    """
+    from yearn_fees.types import TraceFrame
+
+    filler = TraceFrame(pc=0, op="PUSH1", stack=frames[0].stack, memory=frames[0].memory)
+    padding = max(num_frames - len(frames), 0)
+    return concat(repeat(filler, padding), frames)
+
+
+def synthetic_struct_logs(fixture, num_frames):
+    return islice(cycle(fixture["struct_logs"]), num_frames)
+
+
+def run_component(component, fixture_path, num_frames=None) -> Dict:
+    """
+    Run a single component over a fixture, or over a synthetic trace of `num_frames`.
+    """
+    from yearn_fees import vmtrace
+    from yearn_fees.cache import CompressedDisk
+    from yearn_fees.memory_layout import MemoryLayout
+    from yearn_fees.traces import fees_from_trace, split_by_metadata
+    from yearn_fees.types import TraceFrame
+
+    fixture = load_fixture(fixture_path)
+    metadata = fixture_metadata(fixture)
+    frames = [TraceFrame.parse(frame) for frame in fixture["struct_logs"]]
+    parts = split_by_metadata(iter(frames), iter(metadata))
+
+    def parse():
+        struct_logs = (
+            synthetic_struct_logs(fixture, num_frames) if num_frames else fixture["struct_logs"]
+        )
+        num = 0
+        for frame in struct_logs:
+            TraceFrame.parse(frame)
+            num += 1
+        return num
+
+    def split():
+        trace = synthetic_frames(frames, num_frames) if num_frames else iter(frames)
+        split_by_metadata(trace, iter(metadata))
+        return num_frames or len(frames)
+
+    def memory_layout():
+        for part, meta in zip(parts, metadata):
+            MemoryLayout(part, meta.version)
+        return sum(len(part) for part in parts)
+
+    def extract():
+        for part, meta in zip(parts, metadata):
+            fees_from_trace(part, meta.version)
+        return sum(len(part) for part in parts)
+
+    def compressed_disk():
+        import diskcache
+
+        with tempfile.TemporaryDirectory() as directory:
+            with diskcache.Cache(directory, disk=CompressedDisk) as cache:
+                cache["parts"] = parts
+                cache["parts"]
+        return sum(len(part) for part in parts)
+
+    def vmtrace_decode():
+        vm_path = fixture_path.with_name(f"{fixture['tx']}.vmtrace.json.gz")
+        if not vm_path.exists():
+            return 0
+        trace = vmtrace.decoder.decode(gzip.decompress(vm_path.read_bytes()))
+        return len(trace.ops)
+
+    components = {
+        "parse": parse,
+        "split_trace": split,
+        "memory_layout": memory_layout,
+        "fees_from_trace": extract,
+        "compressed_disk": compressed_disk,
+        "vmtrace_decode": vmtrace_decode,
+    }
+    func = components[component]
+
+    # timing run, the lifetime peak rss so far comes from loading and parsing the fixture
+    rss_setup = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    frames_processed = func()
+    elapsed = perf_counter() - start
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # allocation run, skipped for synthetic traces where tracemalloc is too slow
+    alloc_peak = retained_blocks = None
+    if not num_frames:
+        tracemalloc.start()
+        blocks = sys.getallocatedblocks()
+        func()
+        # net blocks still allocated afterwards, blocks freed during the run don't show up
+        retained_blocks = sys.getallocatedblocks() - blocks
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        "component": component,
+        "fixture": f"{fixture_path.parent.name}/{fixture['tx']}",
+        "frames": frames_processed,
+        "seconds": elapsed,
+        "frames_per_second": frames_processed / elapsed if elapsed else None,
+        # linux reports kilobytes
+        "peak_rss_growth_mb": (rss_peak - rss_setup) / 1024,
+        "alloc_peak_mb": alloc_peak / 2**20 if alloc_peak is not None else None,
+        "retained_blocks": retained_blocks,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(components=None, versions=None, synthetic=SYNTHETIC_FRAMES) -> List[Dict]:
+    """
+    Run all components over all fixtures, each in a fresh process.
+    """
+    components = components or [
+        "parse",
+        "split_trace",
+        "memory_layout",
+        "fees_from_trace",
+        "compressed_disk",
+        "vmtrace_decode",
+    ]
+    generate_fixtures()
+    paths = sorted(
+        path
+        for path in FIXTURES.glob("*/*.json.gz")
+        if not path.name.endswith(".vmtrace.json.gz")
+        and (not versions or path.parent.name in versions)
+    )
+    cases = [(component, path, None) for path in paths for component in components]
+    # scale up the first fixture for components which stream the whole trace
+    if paths:
+        cases += [
+            (component, paths[0], num_frames)
+            for num_frames in synthetic
+            for component in ["parse", "split_trace"]
+            if component in components
+        ]
+
+    commit = git_commit()
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    RESULTS.parent.mkdir(exist_ok=True)
+
+    with RESULTS.open("at") as f:
+        for component, path, num_frames in cases:
+            with ctx.Pool(1, maxtasksperchild=1) as pool:
+                result = pool.apply(run_component, (component, path, num_frames))
+            if not result["frames"]:
+                continue
+            result.update(commit=commit, time=time(), synthetic=num_frames is not None)
+            results.append(result)
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+
+    return results
+
+
+def load_results(commit) -> Dict:
+    """
+    Read the latest result for each case of a commit.
+    """
+    results = {}
+    for line in RESULTS.read_text().splitlines():
+        result = json.loads(line)
+        if result["commit"] == commit:
+            results[result["component"], result["fixture"], result["frames"]] = result
+
+    return results
+
+
+def display(results: List[Dict]):
+    table = Table(box=box.SIMPLE)
+    for column in ["component", "fixture", "frames", "frames/s", "peak rss growth", "alloc peak"]:
+        table.add_column(column, justify="left" if column in ["component", "fixture"] else "right")
+
+    for r in results:
+        table.add_row(
+            r["component"],
+            r["fixture"],
+            f"{r['frames']:,d}",
+            f"{r['frames_per_second']:,.0f}" if r["frames_per_second"] else "",
+            f"{r['peak_rss_growth_mb']:,.1f} MB" if "peak_rss_growth_mb" in r else "",
+            f"{r['alloc_peak_mb']:,.1f} MB" if r["alloc_peak_mb"] is not None else "",
+        )
+
+    Console().print(table)
+
+
+def compare(base, head=None):
+    """
+    Compare throughput between two commits.
+    """
+    head = head or git_commit()
+    before = load_results(base)
+    after = load_results(head)
+
+    table = Table(title=f"{base} → {head}", box=box.SIMPLE)
+    for column in ["component", "fixture", "frames", base, head, "change"]:
+        table.add_column(column, justify="left" if column in ["component", "fixture"] else "right")
+
+    for key in sorted(before.keys() & after.keys()):
+        a = before[key]["frames_per_second"]
+        b = after[key]["frames_per_second"]
+        if not a or not b:
+            continue
+        change = b / a - 1
+        color = "green" if change >= 0 else "red"
+        table.add_row(
+            key[0], key[1], f"{key[2]:,d}", f"{a:,.0f}", f"{b:,.0f}", f"[{color}]{change:+.1%}"
+        )
+
+    Console().print(table)
+
+
+def parse_importtime(output) -> List[Dict]:
+    """
+    Top level imports from `python -X importtime`, slowest first.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # nested imports are indented
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        imports.append({"module": name.strip(), "seconds": int(cumulative) / 1e6})
+
+    return sorted(imports, key=lambda item: item["seconds"], reverse=True)
+
+
+def startup(commands=None, repeat=5) -> List[Dict]:
+    """
+    Measure the wall time of cli invocations and find the slowest imports of each.
+    """
+    cli = [sys.executable, "-m", "yearn_fees.cli"]
+    commit = git_commit()
+    results = []
+    STARTUP_RESULTS.parent.mkdir(exist_ok=True)
+
+    with STARTUP_RESULTS.open("at") as f:
+        for command in commands or STARTUP_COMMANDS:
+            args = shlex.split(command)
+            times = []
+            for _ in range(repeat):
+                start = perf_counter()
+                subprocess.run(cli + args, capture_output=True)
+                times.append(perf_counter() - start)
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", *cli[1:], *args],
+                capture_output=True,
+                text=True,
+            )
+            result = {
+                "command": command,
+                "seconds": statistics.median(times),
+                "imports": parse_importtime(proc.stderr)[:10],
+                "commit": commit,
+                "time": time(),
+            }
+            results.append(result)
+            f.write(json.dumps(result) + "\n")
+
+    return results
+
+
+def display_startup(results: List[Dict]):
+    table = Table(box=box.SIMPLE)
+    table.add_column("command")
+    table.add_column("seconds", justify="right")
+    table.add_column("slowest imports")
+
+    for r in results:
+        imports = ", ".join(f"{i['module']} {i['seconds']:.2f}s" for i in r["imports"][:3])
+        color = "green" if r["seconds"] < 1 else "red"
+        table.add_row(r["command"], f"[{color}]{r['seconds']:.2f}", imports)
+
+    Console().print(table)
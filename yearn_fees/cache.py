@@ -1,8 +1,29 @@
 import gzip
+import os
 import pickle
+import threading
+from multiprocessing.connection import Client
+from time import perf_counter, time
 
 import diskcache
 
+CACHE_DIR = "cache"
+SIZE_LIMIT = 20_000_000_000
+# disk, fanout or server
+CACHE_BACKEND = os.environ.get("YEARN_FEES_CACHE", "disk")
+CACHE_SHARDS = int(os.environ.get("YEARN_FEES_CACHE_SHARDS", 8))
+CACHE_SOCKET = os.environ.get("YEARN_FEES_CACHE_SOCKET", os.path.join(CACHE_DIR, "server.sock"))
+# the sharded cache starts empty, fill it from the disk cache with `migrate_to_fanout`
+FANOUT_DIR = os.path.join(CACHE_DIR, "fanout")
+
+
+def dumps(value) -> bytes:
+    return gzip.compress(pickle.dumps(value))
+
+
+def loads(data: bytes):
+    return pickle.loads(gzip.decompress(data))
+
 
 class CompressedDisk(diskcache.Disk):
     """
@@ -14,14 +35,170 @@ class CompressedDisk(diskcache.Disk):
 
     def store(self, value, read, key=diskcache.UNKNOWN):
         if not read:
-            value = gzip.compress(pickle.dumps(value))
+            value = dumps(value)
         return super().store(value, read, key=key)
 
     def fetch(self, mode, filename, value, read):
         data = super().fetch(mode, filename, value, read)
         if not read:
-            data = pickle.loads(gzip.decompress(data))
+            data = loads(data)
         return data
 
 
-cache = diskcache.Cache("cache", size_limit=20_000_000_000, disk=CompressedDisk)
+class LockWait:
+    """
+    Time spent waiting for the sqlite write lock in this process.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        # metrics pulls in dask, most importers of the cache don't need it
+        from yearn_fees import metrics
+
+        with self.lock:
+            self.seconds += seconds
+            self.count += 1
+        metrics.add_time("cache_lock_wait", seconds)
+
+    def as_dict(self):
+        with self.lock:
+            return {"lock_wait_seconds": self.seconds, "writes": self.count}
+
+
+lock_wait = LockWait()
+
+
+class TimedCache(diskcache.Cache):
+    """
+    A cache which records how long each write waits for the database lock.
+    """
+
+    @property
+    def _sql(self):
+        # all diskcache writes start a transaction with this statement
+        execute = super()._sql
+
+        def sql(statement, *args, **kwargs):
+            if statement != "BEGIN IMMEDIATE":
+                return execute(statement, *args, **kwargs)
+            start = perf_counter()
+            try:
+                return execute(statement, *args, **kwargs)
+            finally:
+                lock_wait.add(perf_counter() - start)
+
+        return sql
+
+
+class TimedFanoutCache(diskcache.FanoutCache):
+    """
+    A cache sharded across several databases, so concurrent writers rarely share a lock.
+    """
+
+    def __init__(self, directory, shards=CACHE_SHARDS, **settings):
+        super().__init__(directory, shards=shards, **settings)
+        # fanout doesn't take a shard class, the shards hold no extra state
+        for shard in self._shards:
+            shard.__class__ = TimedCache
+
+
+class CacheClient:
+    """
+    The part of the `diskcache.Cache` interface the pipeline uses, served by `cache_server`.
+    """
+
+    def __init__(self, address=CACHE_SOCKET, directory=CACHE_DIR):
+        self.address = address
+        self.directory = directory
+        # connections can't be shared between threads
+        self.local = threading.local()
+
+    def call(self, op, *args):
+        from yearn_fees import metrics
+
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            try:
+                conn = self.local.conn = Client(self.address, family="AF_UNIX")
+            except (FileNotFoundError, ConnectionRefusedError):
+                raise ConnectionError(
+                    "cache server is not running, start it with `yearn-fees cache-server`",
+                    self.address,
+                ) from None
+
+        start = perf_counter()
+        conn.send((op, args))
+        status, result = conn.recv()
+        metrics.add_time("cache_server", perf_counter() - start)
+        if status == "error":
+            raise RuntimeError("cache server error", result)
+
+        return result
+
+    def get(self, key, default=None, **kwargs):
+        data = self.call("get", key)
+        return default if data is None else loads(data)
+
+    def set(self, key, value, expire=None, tag=None, **kwargs):
+        return self.call("set", key, dumps(value), expire, tag)
+
+    def __getitem__(self, key):
+        data = self.call("get", key)
+        if data is None:
+            raise KeyError(key)
+        return loads(data)
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.call("contains", key)
+
+    def delete(self, key, **kwargs):
+        return self.call("delete", key)
+
+    def stats(self):
+        return self.call("stats")
+
+    # only relies on `get` and `set`
+    memoize = diskcache.Cache.memoize
+
+
+def migrate_to_fanout(source=CACHE_DIR, target=FANOUT_DIR, shards=CACHE_SHARDS) -> int:
+    """
+    Copy the disk cache into the sharded cache with their expiry and tags.
+    Values are copied as compressed bytes. Keys are assigned to shards by their hash,
+    so the shard count must stay the same afterwards.
+    """
+    # the default disk passes the stored bytes through
+    src = diskcache.Cache(source)
+    dst = diskcache.FanoutCache(target, shards=shards, size_limit=SIZE_LIMIT)
+    num = 0
+    for key in src.iterkeys():
+        value, expire_time, tag = src.get(key, expire_time=True, tag=True, retry=True)
+        # expired since it was listed
+        if value is None:
+            continue
+        expire = expire_time - time() if expire_time else None
+        dst.set(key, value, expire=expire, tag=tag, retry=True)
+        num += 1
+
+    return num
+
+
+def open_cache():
+    if CACHE_BACKEND == "server":
+        return CacheClient(CACHE_SOCKET, CACHE_DIR)
+    if CACHE_BACKEND == "fanout":
+        return TimedFanoutCache(FANOUT_DIR, size_limit=SIZE_LIMIT, disk=CompressedDisk)
+    if CACHE_BACKEND == "disk":
+        return TimedCache(CACHE_DIR, size_limit=SIZE_LIMIT, disk=CompressedDisk)
+
+    raise ValueError("unknown cache backend", CACHE_BACKEND)
+
+
+cache = open_cache()
@@ -0,0 +1,94 @@
+"""
+A cache process shared by the indexer workers over a unix socket.
+
+Only the server opens the sqlite databases, so workers don't contend on file locks.
+Clients pickle and compress values themselves and the server stores the bytes as is,
+which is the same format `CompressedDisk` writes, so it serves the regular disk cache.
+"""
+
+import os
+import threading
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Listener
+from time import perf_counter, sleep
+
+from yearn_fees.cache import (
+    CACHE_DIR,
+    CACHE_SOCKET,
+    SIZE_LIMIT,
+    TimedCache,
+    TimedFanoutCache,
+    lock_wait,
+)
+
+# stored values are never None, they are compressed pickles
+OPS = {
+    "get": lambda store, key: store.get(key, retry=True),
+    "set": lambda store, key, data, expire, tag: store.set(
+        key, data, expire=expire, tag=tag, retry=True
+    ),
+    "contains": lambda store, key: key in store,
+    "delete": lambda store, key: store.delete(key, retry=True),
+    "stats": lambda store: lock_wait.as_dict(),
+}
+
+
+def open_store(directory=CACHE_DIR, shards=0):
+    # values arrive compressed, so the default disk stores them unchanged
+    if shards:
+        return TimedFanoutCache(os.path.join(directory, "fanout"), shards, size_limit=SIZE_LIMIT)
+    return TimedCache(directory, size_limit=SIZE_LIMIT)
+
+
+def handle(conn, store):
+    with conn:
+        while True:
+            try:
+                op, args = conn.recv()
+            except EOFError:
+                return
+            try:
+                conn.send(("ok", OPS[op](store, *args)))
+            except Exception as e:
+                conn.send(("error", repr(e)))
+
+
+def serve(address=CACHE_SOCKET, directory=CACHE_DIR, shards=0):
+    """
+    Serve the cache over a unix socket, with a thread per connected client.
+    """
+    store = open_store(directory, shards)
+    if os.path.exists(address):
+        os.remove(address)
+
+    with Listener(address, family="AF_UNIX") as listener:
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=handle, args=(conn, store), daemon=True).start()
+
+
+def is_running(address=CACHE_SOCKET) -> bool:
+    try:
+        Client(address, family="AF_UNIX").close()
+        return True
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+
+
+def ensure_running(address=CACHE_SOCKET, directory=CACHE_DIR, shards=0, timeout=10):
+    """
+    Start a cache server for the lifetime of this process unless one is running already.
+    """
+    if is_running(address):
+        return
+
+    # spawn to avoid forking the threads of the parent
+    process = get_context("spawn").Process(
+        target=serve, args=(address, directory, shards), daemon=True
+    )
+    process.start()
+    deadline = perf_counter() + timeout
+    while not is_running(address):
+        if perf_counter() > deadline or not process.is_alive():
+            raise ConnectionError("cache server failed to start", address)
+        sleep(0.05)
@@ -4,34 +4,43 @@ yearn-fees layout 0xabc..def
 
 yearn-fees compare 0.4.3
 yearn-fees compare 0xabc..def
+
+Heavy modules like ape, dask and the trace pipeline are imported within the commands,
+so `--help` and commands which don't need a node start fast. The node is only connected to
+on the first lookup which isn't cached, see `node.needs_node`.
 """
 import json
+import os
 
 import click
-from ape import chain, networks
 from rich import print
 
-from yearn_fees import fork, indexer, scanner, utils
-from yearn_fees.compare import compare_methods
+from yearn_fees import archive, profiling
 from yearn_fees.memory_layout import MEMORY_LAYOUT
-from yearn_fees.utils import get_sample_txs, get_trace
-
-
-class MainnetCommand(click.Command):
-    def invoke(self, ctx):
-        with networks.ethereum.mainnet.use_default_provider():
-            chain.provider.web3.provider._request_kwargs["timeout"] = 600
-            super().invoke(ctx)
 
 
 @click.group()
-def cli():
-    pass
+@click.option("--profile", is_flag=True, help="write sampling profiles to profiles/")
+@click.option(
+    "--offline",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="read everything from an archive instead of a node",
+)
+def cli(profile, offline):
+    # set in the environment so dask workers inherit it
+    if profile:
+        os.environ[profiling.PROFILE_ENV] = "1"
+    if offline:
+        os.environ[archive.OFFLINE_ENV] = offline
 
 
-@cli.command(cls=MainnetCommand)
+@cli.command()
 @click.argument("version_or_tx")
 def layout(version_or_tx):
+    from yearn_fees import scanner
+    from yearn_fees.utils import get_sample_txs
+
     if version_or_tx in MEMORY_LAYOUT:
         txs = get_sample_txs(version_or_tx, 10, 5)
         for tx in txs:
@@ -40,20 +49,36 @@ def layout(version_or_tx):
         scanner.layout_tx(version_or_tx)
 
 
-@cli.command(cls=MainnetCommand)
+@cli.command()
 @click.argument("version_or_tx")
-def compare(version_or_tx):
+@click.option("--vaults", type=click.IntRange(min=1), default=10)
+@click.option("--txs", type=click.IntRange(min=1), default=5, help="txs per vault")
+@click.option("--workers", type=click.IntRange(min=1), default=4)
+@click.option("--no-fork", is_flag=True, help="skip the fork method")
+# same as compare.METHODS, listed here to keep the import lazy
+@click.option(
+    "--refresh",
+    type=click.Choice(["assess", "trace", "fork"]),
+    multiple=True,
+    help="ignore cached results",
+)
+def compare(version_or_tx, vaults, txs, workers, no_fork, refresh):
+    from yearn_fees.compare import METHODS, batch_compare, compare_methods
+    from yearn_fees.utils import get_sample_txs
+
     if version_or_tx in MEMORY_LAYOUT:
-        txs = get_sample_txs(version_or_tx, 10, 5)
-        for tx in txs:
-            compare_methods(tx, only_version=version_or_tx)
+        sample = get_sample_txs(version_or_tx, vaults, txs)
+        methods = [method for method in METHODS if not (no_fork and method == "fork")]
+        batch_compare(sample, version_or_tx, methods, workers, refresh)
     else:
         compare_methods(version_or_tx)
 
 
-@cli.command(cls=MainnetCommand)
+@cli.command()
 @click.argument("tx")
 def dump_trace(tx):
+    from yearn_fees.utils import get_trace
+
     trace = get_trace(tx)
 
     path = f"traces/{tx}.json"
@@ -63,51 +88,354 @@ def dump_trace(tx):
     print(path)
 
 
-@cli.command(cls=MainnetCommand)
-def index():
-    indexer.start()
+@cli.command()
+@click.option(
+    "--metrics-file", type=click.Path(), default=None, help="append metrics as json lines"
+)
+@click.option("--metrics-port", type=int, default=None, help="serve prometheus metrics")
+# same as verification.Mode, listed here to keep the import lazy
+@click.option(
+    "--verify",
+    type=click.Choice(["strict", "trace", "assess", "sample"]),
+    default="strict",
+    help="which methods to run for each report",
+)
+@click.option("--sample-rate", type=click.IntRange(min=1), default=10, help="verify 1 in N reports")
+@click.option("--verify-version", multiple=True, help="per version override, e.g. 0.4.3=sample:50")
+@click.option(
+    "--measurements",
+    type=click.Path(exists=True),
+    default=None,
+    help="plan the txs with a cost model fit on trace measurements",
+)
+def index(metrics_file, metrics_port, verify, sample_rate, verify_version, measurements):
+    from yearn_fees import indexer, verification
+
+    policy = verification.VerificationPolicy.parse(verify, sample_rate, verify_version)
+    indexer.start(
+        metrics_file=metrics_file,
+        metrics_port=metrics_port,
+        policy=policy,
+        measurements=measurements,
+    )
+
+
+@cli.command()
+@click.option("--measurements", type=click.Path(exists=True), default="dropped-trace-sizes.jsonl")
+@click.option("--workers", type=click.IntRange(min=1), default=4)
+@click.option("--max-frames", type=int, default=20_000_000)
+@click.option("--memory-budget", type=float, default=4, help="gigabytes across all workers")
+def plan(measurements, workers, max_frames, memory_budget):
+    """
+    Predict trace sizes and an eta for all txs without fetching any trace.
+    """
+    from yearn_fees import planner
+    from yearn_fees.utils import get_reports
+
+    signals = planner.tx_signals(get_reports())
+    model = planner.CostModel(planner.load_measurements(signals, measurements))
+    result = planner.make_plan(
+        list(signals), model, signals, workers, max_frames, memory_budget * 2**30
+    )
+    planner.display_plan(result)
+
+
+@cli.command()
+@click.argument("path", type=click.Path(file_okay=False))
+@click.option("--version", default=None, help="only archive txs with reports of a version")
+@click.option("--no-traces", is_flag=True, help="skip split traces")
+@click.option("--workers", type=click.IntRange(min=1), default=4)
+def export_archive(path, version, no_traces, workers):
+    """
+    Write an archive for running the pipeline offline with `yearn-fees --offline <path>`.
+    """
+    from yearn_fees import utils
+
+    txs = None
+    if version:
+        vaults = set(utils.get_endorsed_vaults(version))
+        txs = list(
+            {
+                report.transaction_hash.hex()
+                for report in utils.get_reports()
+                if report.contract_address in vaults
+            }
+        )
+    print(archive.export(path, txs, include_traces=not no_traces, workers=workers))
+
+
+@cli.command()
+@click.option("--path", type=click.Path(file_okay=False), default="parquet/reports")
+def export_parquet(path):
+    """
+    Append new reports to a Parquet dataset partitioned by version and month.
+    """
+    from yearn_fees import export_parquet
+    from yearn_fees.models import bind_db
+    from yearn_fees.utils import plural
+
+    bind_db()
+    num = export_parquet.export(path)
+    print(f"exported {plural('report', num)} to {path}")
+
+
+@cli.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", type=int, default=8000)
+@click.option("--cache-size", type=int, default=10_000, help="cached responses")
+def serve(host, port, cache_size):
+    """
+    Serve a json api over the indexed reports and fee rollups.
+    """
+    from yearn_fees import api
+    from yearn_fees.models import bind_db
+
+    bind_db()
+    server, cache = api.serve(host, port, cache_size)
+    print(f"serving at http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"cache hits={cache.hits} misses={cache.misses}")
+
+
+@cli.command()
+@click.option(
+    "--shards", type=int, default=0, help="serve the sharded cache, 0 serves the disk cache"
+)
+@click.option("--interval", type=int, default=60, help="seconds between lock wait reports")
+def cache_server(shards, interval):
+    """
+    Serve the cache to workers over a unix socket, use with YEARN_FEES_CACHE=server.
+    """
+    import threading
+    from time import sleep
+
+    from yearn_fees import cache_server
+    from yearn_fees.cache import CACHE_SOCKET, lock_wait
+
+    def report():
+        while True:
+            sleep(interval)
+            stats = lock_wait.as_dict()
+            print(f"writes={stats['writes']} lock_wait={stats['lock_wait_seconds']:.3f}s")
+
+    threading.Thread(target=report, daemon=True).start()
+    print(f"serving cache at {CACHE_SOCKET}")
+    try:
+        cache_server.serve(CACHE_SOCKET, shards=shards)
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.option("--shards", type=int, default=8, help="must match YEARN_FEES_CACHE_SHARDS")
+def migrate_cache(shards):
+    """
+    Copy the disk cache into the sharded cache, which starts empty.
+    """
+    from yearn_fees.cache import migrate_to_fanout
+
+    print(f"copied {migrate_to_fanout(shards=shards):,d} entries")
+
+
+@cli.command()
+def rebuild_rollups():
+    """
+    Recompute the fee rollup tables and index the reports table.
+    """
+    from yearn_fees import rollups
+    from yearn_fees.models import bind_db
+
+    bind_db()
+    rollups.rebuild()
+
 
+@cli.command()
+def verification_stats():
+    """
+    Show mismatch rates per version.
+    """
+    from yearn_fees import verification
+    from yearn_fees.models import bind_db
 
-@cli.command("fork", cls=MainnetCommand)
+    bind_db()
+    verification.show_stats()
+
+
+@cli.command("fork")
 @click.argument("tx")
-def fork_version(tx):
+# same as fork.FORK_MODES, listed here to keep the import lazy
+@click.option("--mode", type=click.Choice(["replay", "call"]), default=None)
+def fork_version(tx, mode):
+    from yearn_fees import fork, utils
+
     reports = utils.reports_from_tx(tx)
-    fees = fork.fork_tx(tx)
+    fees = fork.fork_tx(tx, mode=mode)
     for fee, report in zip(fees, reports):
         decimals = utils.get_decimals(report.contract_address)
         version = utils.version_from_report(report)
         fee.as_table(decimals, title=version)
-    fork.fork_tx(tx)
 
 
-@cli.command(cls=MainnetCommand)
+@cli.command()
 @click.argument("version_or_tx")
 @click.option("--samples", type=click.IntRange(min=1), default=10)
-def find_duration(version_or_tx, samples):
+@click.option(
+    "--field",
+    type=click.Choice(["duration", "gain", "management_fee", "performance_fee", "strategist_fee"]),
+    default="duration",
+)
+def find_duration(version_or_tx, samples, field):
+    from yearn_fees import scanner
+
     if version_or_tx in MEMORY_LAYOUT:
         version = version_or_tx
-        scanner.find_duration(version, samples=samples)
+        scanner.find_field(version, field, samples=samples)
     else:
         tx = version_or_tx
-        scanner.find_duration_from_tx(tx)
-
-
-@cli.command(cls=MainnetCommand)
-def dropped():
-    from yearn_fees.compare import compare_methods
-    from rich.progress import track
-    import json
-    from os.path import exists
-
-    dropped = open('dropped-txs.csv').read().splitlines()
-    for tx in track(dropped):
-        path = f'traces/{tx}.json'
-        if exists(path):
-            continue
-        data = compare_methods(tx)
-        data = [{key: value.dict() for key, value in item.items()} for item in data]
-        with open(path, 'wt') as f:
-            json.dump(data, f, default=str, indent=2)
+        scanner.find_field_from_tx(tx, field)
+
+
+@cli.command()
+@click.option("--limit", type=click.IntRange(min=1), default=None)
+@click.option("--all", "include_scheduled", is_flag=True, help="ignore the backoff schedule")
+@click.option("--workers", type=click.IntRange(min=1), default=4)
+@click.option("--from-csv", type=click.Path(exists=True), help="enqueue txs from a file")
+def dropped(limit, include_scheduled, workers, from_csv):
+    """
+    Retry txs from the dead-letter queue.
+    """
+    from yearn_fees import indexer, retries
+    from yearn_fees.models import bind_db
+
+    if from_csv:
+        bind_db()
+        for tx in open(from_csv).read().splitlines():
+            retries.enqueue(tx)
+
+    indexer.retry_dropped(limit=limit, due_only=not include_scheduled, n_workers=workers)
+
+
+@cli.command()
+@click.argument("version")
+@click.option("--vaults", type=click.IntRange(min=1), default=10)
+@click.option("--txs", type=click.IntRange(min=1), default=5, help="txs per vault")
+@click.option("--workers", type=click.IntRange(min=1), default=4)
+@click.option("--output", type=click.Path(), default=None)
+def discover(version, vaults, txs, workers, output):
+    """
+    Discover program counters and memory slots to extract fees from for a version.
+    """
+    from yearn_fees import discover
+
+    table = discover.discover(version, vaults, txs, workers)
+    discover.display_table(table)
+    print(discover.write_table(table, output))
+
+
+@cli.group()
+def benchmark():
+    """
+    Offline benchmarks of the trace pipeline.
+    """
+
+
+@benchmark.command("record")
+@click.argument("txs", nargs=-1, required=True)
+@click.option("--vmtrace", is_flag=True, help="also record vmTrace")
+def benchmark_record(txs, vmtrace):
+    from yearn_fees import benchmark
+
+    for tx in txs:
+        print(benchmark.record_fixture(tx, vmtrace=vmtrace))
+
+
+@benchmark.command("run")
+@click.option("--component", "components", multiple=True)
+@click.option("--version", "versions", multiple=True)
+@click.option("--frames", multiple=True, type=int, help="synthetic trace sizes")
+def benchmark_run(components, versions, frames):
+    from yearn_fees import benchmark
+
+    results = benchmark.run(components, versions, frames or benchmark.SYNTHETIC_FRAMES)
+    benchmark.display(results)
+
+
+@benchmark.command("compare")
+@click.argument("base")
+@click.argument("head", required=False)
+def benchmark_compare(base, head):
+    from yearn_fees import benchmark
+
+    benchmark.compare(base, head)
+
+
+@benchmark.command("startup")
+@click.argument("commands", nargs=-1)
+@click.option("--repeat", type=click.IntRange(min=1), default=5)
+def benchmark_startup(commands, repeat):
+    """
+    Measure cli startup time, e.g. `benchmark startup -- --help "layout 0xabc..def"`.
+    """
+    from yearn_fees import benchmark
+
+    benchmark.display_startup(benchmark.startup(commands, repeat))
+
+
+@cli.command()
+@click.argument("mode", type=click.Choice(["record", "replay"]))
+@click.option("--port", type=int, default=8546)
+@click.option("--upstream", default="http://127.0.0.1:8545")
+@click.option("--latency", type=float, default=0.0, help="seconds added to each response")
+@click.option("--bandwidth", type=float, default=None, help="megabytes per second")
+@click.option("--passthrough", is_flag=True, help="fetch missing responses from upstream")
+def replay_node(mode, port, upstream, latency, bandwidth, passthrough):
+    """
+    Run a local json-rpc node which records or replays responses.
+    """
+    from yearn_fees.replay import ReplayNode
+
+    node = ReplayNode(
+        mode=mode,
+        upstream=upstream,
+        latency=latency,
+        bandwidth=bandwidth * 2**20 if bandwidth else None,
+        passthrough=passthrough,
+    )
+    server = node.serve(port=port)
+    print(f"{mode} node at http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(node.stats)
+
+
+@cli.command("compile")
+@click.argument("versions", nargs=-1)
+@click.option("--workers", type=click.IntRange(min=1), default=None)
+def compile_artifacts(versions, workers):
+    """
+    Compile vault sources ahead of time so no other command compiles inline.
+    """
+    from yearn_fees import compilation
+    from yearn_fees.utils import plural
+
+    compiled = compilation.warm_up(list(versions) or None, workers)
+    print(f"compiled {plural('version', len(compiled))}")
+
+
+@cli.command()
+@click.option("--output", default="merged.collapsed")
+@click.option("--speedscope", type=click.Path(), default=None, help="also write speedscope json")
+@click.option("--tx", default=None, help="only merge profiles of a tx")
+def merge_profiles(output, speedscope, tx):
+    """
+    Merge per-task profiles from all workers into one flame graph.
+    """
+    pattern = f"{tx}.*.collapsed" if tx else "*.collapsed"
+    paths, stacks = profiling.write_merged(pattern, output, speedscope)
+    print(f"merged {len(paths)} profiles with {sum(stacks.values())} samples into {output}")
 
 
 if __name__ == "__main__":
@@ -1,19 +1,26 @@
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from decimal import Decimal
-from typing import Dict
+from typing import Dict, List
 
 from rich import box, print
 from rich.console import Console
+from rich.progress import track
 from rich.table import Table
 
 from yearn_fees import assess, fork, utils
+from yearn_fees.cache import cache
 from yearn_fees.traces import fees_from_trace
 from yearn_fees.types import Fees
 
+FIELDS = ["management_fee", "performance_fee", "strategist_fee", "gain", "duration"]
+METHODS = ["assess", "trace", "fork"]
+
 
 def compare_methods(tx, only_version=None):
     tx = tx.hex() if isinstance(tx, bytes) else tx
     reports = utils.reports_from_tx(tx)
-    traces = utils.get_split_trace(tx)
+    traces = utils.get_split_trace(tx, reports=reports)
     forked = fork.fork_tx(tx)
     print(f"[green]found {len(reports)} reports at {tx}")
 
@@ -32,12 +39,12 @@ def compare_methods(tx, only_version=None):
         fees_calc = assess.assess_fees(report)
         fees_calc.as_table(decimals, title="calculated fees")
 
-        fees_trace = fees_from_trace(trace, version)
+        fees_trace = fees_from_trace(trace, version, tx)
         fees_trace.as_table(decimals, title="trace fees")
 
         results.append({"assess": fees_calc, "trace": fees_trace, "fork": fork_report})
         compare_as_table(results[-1], decimals)
-    
+
     return results
 
 
@@ -55,21 +62,11 @@ def compare_as_table(fees: Dict[str, Fees], decimals: int, output=True):
             return format(value, ",d") if value is not None else value
 
         return (
-            format(Decimal(value) / 10**decimals, f",.{decimals}f")
-            if value is not None
-            else value
+            format(Decimal(value) / 10**decimals, f",.{decimals}f") if value is not None else value
         )
 
-    for key in [
-        "management_fee",
-        "performance_fee",
-        "strategist_fee",
-        # "total_fee",
-        "gain",
-        "duration",
-    ]:
+    for key in FIELDS:
         values_set = {getattr(source, key, None) for source in fees.values()}
-        print(f"{values_set=}")
         table.add_row(
             key,
             *[format_value(source, key) for source in fees.values()],
@@ -81,3 +78,133 @@ def compare_as_table(fees: Dict[str, Fees], decimals: int, output=True):
         console.print(table)
     else:
         return table
+
+
+def cached_results(method, keys, compute, refresh=()):
+    """
+    Read per-report results of a method from cache, computing all of them if any is missing.
+    """
+    cache_keys = [f"compare:{method}:{key}" for key in keys]
+    if method not in refresh:
+        results = [cache.get(key) for key in cache_keys]
+        if all(result is not None for result in results):
+            return results
+
+    results = compute()
+    for key, result in zip(cache_keys, results):
+        cache[key] = result
+
+    return results
+
+
+def collect_methods(tx, only_version=None, methods=METHODS, refresh=()) -> List[Dict]:
+    """
+    Run each method for all reports in a tx without printing anything.
+    """
+    reports = utils.reports_from_tx(tx)
+    versions = [utils.version_from_report(report) for report in reports]
+    if only_version and only_version not in versions:
+        return []
+
+    keys = [f"{tx}:{report.log_index}" for report in reports]
+    results = {}
+
+    if "assess" in methods:
+        results["assess"] = cached_results(
+            "assess", keys, lambda: [assess.assess_fees(report) for report in reports], refresh
+        )
+
+    if "trace" in methods:
+
+        def compute_trace():
+            traces = utils.get_split_trace(tx, reports=reports)
+            return [
+                fees_from_trace(trace, version, tx) for trace, version in zip(traces, versions)
+            ]
+
+        results["trace"] = cached_results("trace", keys, compute_trace, refresh)
+
+    if "fork" in methods:
+
+        results["fork"] = cached_results("fork", keys, lambda: fork.fork_tx(tx), refresh)
+
+    rows = []
+    for i, (report, version) in enumerate(zip(reports, versions)):
+        if only_version and version != only_version:
+            continue
+        rows.append(
+            {
+                "tx": tx,
+                "log_index": report.log_index,
+                "version": version,
+                "fees": {method: results[method][i] for method in results},
+            }
+        )
+
+    return rows
+
+
+def check_field(fees: Dict[str, Fees], field) -> str:
+    """
+    A field passes if all methods which could recover it agree.
+    """
+    values = {getattr(source, field, None) for source in fees.values()} - {None}
+    if not values:
+        return "n/a"
+    return "pass" if len(values) == 1 else "fail"
+
+
+def batch_compare(txs, only_version=None, methods=METHODS, workers=4, refresh=()):
+    """
+    Compare methods for many txs in parallel and summarize the results per version and field.
+    """
+    rows = []
+    errors = {}
+    utils.prefetch_reports(txs)
+
+    with ThreadPoolExecutor(workers) as pool:
+        tasks = {pool.submit(collect_methods, tx, only_version, methods, refresh): tx for tx in txs}
+        for future in track(as_completed(tasks), total=len(tasks), description="compare"):
+            try:
+                rows.extend(future.result())
+            except Exception as e:
+                errors[tasks[future]] = repr(e)
+
+    summary = defaultdict(lambda: defaultdict(Counter))
+    failed = []
+    for row in rows:
+        checks = {field: check_field(row["fees"], field) for field in FIELDS}
+        for field, status in checks.items():
+            summary[row["version"]][field][status] += 1
+        if "fail" in checks.values():
+            failed.append(row)
+
+    summary_as_table(summary)
+
+    for row in failed:
+        print(f"[red]mismatch[/] version={row['version']} {row['tx']}:{row['log_index']}")
+    for tx, error in errors.items():
+        print(f"[bold red]error[/] {tx} {error}")
+
+    return summary, failed, errors
+
+
+def summary_as_table(summary):
+    table = Table(title="pass/fail by version and field", box=box.SIMPLE)
+    table.add_column("version")
+    for field in FIELDS:
+        table.add_column(field, justify="right")
+
+    def format_cell(counts):
+        cell = f"[green]{counts['pass']}✔︎[/]"
+        if counts["fail"]:
+            cell += f" [red]{counts['fail']}✘[/]"
+        if counts["n/a"]:
+            cell += f" [dim]{counts['n/a']} n/a[/]"
+        return cell
+
+    for version in sorted(summary):
+        table.add_row(version, *[format_cell(summary[version][field]) for field in FIELDS])
+
+    console = Console()
+    console.print(table)
@@ -0,0 +1,121 @@
+"""
+Compiled vault artifacts keyed by the content hash of the source, which pins its compiler.
+
+Use `yearn-fees compile` to compile all sources ahead of time, so no run pays the cost inline.
+"""
+
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import vvm
+from ape_vyper import compiler
+from ethpm_types import ContractType
+from rich import print
+from semantic_version import Version
+
+from yearn_fees import compile_sources
+from yearn_fees.cache import cache
+
+SOURCES = Path("sources")
+FORMATS = ["bytecode_runtime", "abi"]
+
+
+class SourceContractType(ContractType):
+    source: str
+    code: Optional[str]
+
+
+def source_path(version) -> Path:
+    return SOURCES / f"Vault_v{version}.vy"
+
+
+def available_versions() -> List[str]:
+    return sorted(
+        (path.stem.split("_v")[1] for path in SOURCES.glob("Vault_v*.vy")),
+        key=Version,
+    )
+
+
+def artifact_key(source: str) -> str:
+    # the source pins its compiler with a version pragma
+    digest = hashlib.sha256(source.encode()).hexdigest()
+    return f"artifacts:{digest}"
+
+
+def install_compilers(sources: Dict[str, str]) -> Dict[str, Version]:
+    """
+    Resolve a compiler for each source, installing each missing vyper version only once.
+    """
+    specs = {version: compiler.get_pragma_spec(source) for version, source in sources.items()}
+    installed = vvm.get_installed_vyper_versions()
+    missing = [spec for spec in specs.values() if not spec.select(installed)]
+    if missing:
+        installable = vvm.get_installable_vyper_versions()
+        for vyper_version in {spec.select(installable) for spec in missing}:
+            print(f"[yellow]install vyper {vyper_version}")
+            vvm.install_vyper(vyper_version, show_progress=True)
+        installed = vvm.get_installed_vyper_versions()
+
+    return {version: spec.select(installed) for version, spec in specs.items()}
+
+
+def compile_source(path, vyper_version) -> SourceContractType:
+    vyper_binary = compile_sources.get_executable(vyper_version)
+    stdoutdata, stderrdata, command, proc = compile_sources.vyper_wrapper(
+        vyper_binary=vyper_binary,
+        source_files=str(path),
+        f=",".join(FORMATS),
+    )
+    code, abi = stdoutdata.splitlines()
+
+    return SourceContractType(
+        source=Path(path).read_text(),
+        code=code,
+        abi=json.loads(abi),
+    )
+
+
+def compile_version(version) -> SourceContractType:
+    """
+    Get a compiled vault version from cache or compile it inline.
+    """
+    path = source_path(version)
+    source = path.read_text()
+    key = artifact_key(source)
+
+    artifact = cache.get(key)
+    if artifact is None:
+        # only resolve and install a compiler on a miss
+        vyper_version = install_compilers({version: source})[version]
+        print(f"[yellow]compiling [bold]{path}[/]")
+        artifact = compile_source(path, vyper_version)
+        cache[key] = artifact
+
+    return artifact
+
+
+def warm_up(versions=None, workers=None) -> List[str]:
+    """
+    Compile all missing artifacts concurrently. Returns the versions which were compiled.
+    """
+    versions = versions or available_versions()
+    sources = {version: source_path(version).read_text() for version in versions}
+    missing = [version for version in versions if artifact_key(sources[version]) not in cache]
+    if not missing:
+        return missing
+
+    vyper_versions = install_compilers({version: sources[version] for version in missing})
+
+    with ProcessPoolExecutor(workers) as pool:
+        tasks = {
+            version: pool.submit(compile_source, source_path(version), vyper_versions[version])
+            for version in missing
+        }
+        for version, task in tasks.items():
+            cache[artifact_key(sources[version])] = task.result()
+            print(f"[green]compiled {source_path(version)} with vyper {vyper_versions[version]}")
+
+    return missing
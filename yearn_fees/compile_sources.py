@@ -1,8 +1,7 @@
 import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import vvm
-from ape_vyper import compiler
 from git import Repo
 from git.exc import NoSuchPathError
 from rich.console import Console
@@ -25,15 +24,6 @@ def get_repo():
     return repo
 
 
-def install_vyper(pragma_spec):
-    if not pragma_spec.select(vvm.get_installed_vyper_versions()):
-        vyper_version = pragma_spec.select(vvm.get_installable_vyper_versions())
-        console.log(f"install vyper {vyper_version}")
-        vvm.install_vyper(vyper_version, show_progress=True)
-
-    return pragma_spec.select(vvm.get_installed_vyper_versions())
-
-
 def compile_contract(vyper_version, source_files, formats):
     f = ",".join(formats)
     vyper_binary = get_executable(vyper_version)
@@ -46,6 +36,8 @@ def compile_contract(vyper_version, source_files, formats):
 
 
 def main():
+    from yearn_fees.compilation import install_compilers
+
     repo = get_repo()
     tags = [
         tag.name
@@ -54,34 +46,37 @@ def main():
         and Version(tag.name.lstrip("v")) >= FIRST_PRODUCTION_VERSION
     ]
 
-    with Progress(console=console) as progress:
-        task = progress.add_task("compile sources", total=len(tags))
-        for tag in tags:
-            progress.update(task, description=f"compile {tag}")
-            # check out the tag
-            repo.git.checkout(tag)
-            source = Path("yearn-vaults/contracts/Vault.vy").read_text()
-
-            # install vyper if needed
-            pragma_spec = compiler.get_pragma_spec(source)
-            vyper_version = install_vyper(pragma_spec)
+    # read the sources without checking out each tag
+    sources = {tag: repo.git.show(f"{tag}:contracts/Vault.vy") for tag in tags}
+    for tag, source in sources.items():
+        (Path("sources") / f"Vault_{tag}.vy").write_text(source)
 
-            # compile the contracts
-            source_file = Path(repo.working_dir) / "contracts" / "Vault.vy"
-            compiler_output = compile_contract(vyper_version, source_file, ["source_map", "ast"])
+    # install each vyper version once
+    vyper_versions = install_compilers(sources)
 
-            # write metadata
-            source_copy = Path("sources") / f"Vault_{tag}.vy"
-            source_copy.write_text(source_file.read_text())
-            metadata_path = Path("metadata") / f"{tag}.json"
-            metadata = {
-                "vyper_version": str(vyper_version),
-                "api_version": tag,
-                "source": source_file.read_text(),
-                **compiler_output,
+    with Progress(console=console) as progress:
+        task = progress.add_task("compile sources", total=len(tags))
+        with ProcessPoolExecutor() as pool:
+            tasks = {
+                tag: pool.submit(
+                    compile_contract,
+                    vyper_versions[tag],
+                    Path("sources") / f"Vault_{tag}.vy",
+                    ["source_map", "ast"],
+                )
+                for tag in tags
             }
-            metadata_path.write_text(json.dumps(metadata, indent=2))
-            progress.update(task, advance=1)
+            for tag, future in tasks.items():
+                # write metadata
+                metadata_path = Path("metadata") / f"{tag}.json"
+                metadata = {
+                    "vyper_version": str(vyper_versions[tag]),
+                    "api_version": tag,
+                    "source": sources[tag],
+                    **future.result(),
+                }
+                metadata_path.write_text(json.dumps(metadata, indent=2))
+                progress.update(task, description=f"compiled {tag}", advance=1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+"""
+Discover program counters and memory slots to extract fees from for a vault version.
+
+1. compile the version and find candidate program counters within `_assessFees`
+2. search sampled split traces for the fee values known from `assess_fees`
+3. keep memory positions where a value was found in every sampled report
+"""
+
+import json
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from rich import box
+from rich.console import Console
+from rich.progress import track
+from rich.table import Table
+
+from yearn_fees import compilation, compile_sources
+from yearn_fees.assess import assess_fees
+from yearn_fees.compare import cached_results
+from yearn_fees.find_program_counters import map_source
+from yearn_fees.memory_layout import PROGRAM_COUNTERS
+from yearn_fees.scanner import get_value_indexes
+from yearn_fees.utils import (
+    get_sample_txs,
+    reports_from_tx,
+    version_from_report,
+)
+
+FIELDS = ["management_fee", "performance_fee", "strategist_fee", "duration", "gain"]
+
+
+def candidate_program_counters(version):
+    """
+    Compile a version with source map and ast output and find jumps within `_assessFees`.
+    """
+    path = compilation.source_path(version)
+    source = path.read_text()
+    vyper_version = compilation.install_compilers({version: source})[version]
+    output = compile_sources.compile_contract(vyper_version, path, ["source_map", "ast"])
+    data = {"source": source, "api_version": f"v{version}", **output}
+
+    return sorted(map_source(data, quiet=True))
+
+
+def search_tx(tx, version, program_counters):
+    """
+    Count positions where each fee value appears, deduplicated per report.
+    """
+    reports = reports_from_tx(tx)
+    # new versions are not in PROGRAM_COUNTERS yet, other reports in the tx still need theirs
+    overrides = {**PROGRAM_COUNTERS, version: program_counters}
+    # the trace is only fetched and split if the indexes are not cached
+    indexes = get_value_indexes(tx, program_counters=overrides, reports=reports)
+    matching = [i for i, report in enumerate(reports) if version_from_report(report) == version]
+    keys = [f"{tx}:{reports[i].log_index}" for i in matching]
+    fees = cached_results("assess", keys, lambda: [assess_fees(reports[i]) for i in matching])
+
+    samples = Counter()
+    hits = defaultdict(Counter)
+    for i, report_fees in zip(matching, fees):
+        for field in FIELDS:
+            value = getattr(report_fees, field)
+            if not value:
+                continue
+            samples[field] += 1
+            for match in set(indexes[i].find(value)):
+                if match.loc == "memory":
+                    hits[field][match.pc, match.index] += 1
+
+    return samples, hits
+
+
+def discover(version, num_vaults=10, num_txs=5, workers=4):
+    """
+    Run a sampled search and return a verified extraction table for a version.
+    """
+    program_counters = candidate_program_counters(version)
+    candidates = set(program_counters)
+    txs = get_sample_txs(version, num_vaults, num_txs)
+
+    samples = Counter()
+    hits = defaultdict(Counter)
+    with ThreadPoolExecutor(workers) as pool:
+        tasks = [pool.submit(search_tx, tx, version, program_counters) for tx in txs]
+        for future in track(as_completed(tasks), total=len(tasks), description="search"):
+            tx_samples, tx_hits = future.result()
+            samples.update(tx_samples)
+            for field in tx_hits:
+                hits[field].update(tx_hits[field])
+
+    fields = {}
+    for field in FIELDS:
+        if not samples[field]:
+            continue
+        # prefer candidate pcs and later positions where values are final
+        (pc, slot), num = max(
+            hits[field].items(),
+            key=lambda item: (item[1], item[0][0] in candidates, item[0][0]),
+            default=((None, None), 0),
+        )
+        fields[field] = {
+            "pc": pc,
+            "slot": slot,
+            "hits": num,
+            "samples": samples[field],
+            "verified": num == samples[field],
+        }
+
+    return {"version": version, "program_counters": program_counters, "fields": fields}
+
+
+def write_table(table, path=None):
+    path = Path(path or f"metadata/discovered_v{table['version']}.json")
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(json.dumps(table, indent=2))
+    return path
+
+
+def display_table(table):
+    output = Table(title=f"extraction table for {table['version']}", box=box.SIMPLE)
+    for column in ["field", "pc", "slot", "hits", "verified"]:
+        output.add_column(column, justify="right" if column != "field" else "left")
+
+    for field, item in table["fields"].items():
+        output.add_row(
+            field,
+            str(item["pc"]),
+            str(item["slot"]),
+            f"{item['hits']}/{item['samples']}",
+            "[green]✔︎" if item["verified"] else "[red]✘",
+        )
+
+    console = Console()
+    console.print(output)
@@ -0,0 +1,124 @@
+"""
+Export the reports table to Parquet, partitioned by version and month.
+
+Amounts are stored as decimal128(38, 18), so they keep 18 decimals and up to 20 integer digits.
+An amount which doesn't fit fails the export instead of being truncated.
+Each run only appends the rows which are not in the export yet. The indexer doesn't insert
+rows in block order, so the exported keys are compared instead of keeping a high watermark.
+"""
+
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+from uuid import uuid4
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+from toolz import partition_all
+
+from yearn_fees.models import Report, db_session, select
+
+EXPORT_PATH = "parquet/reports"
+BATCH_SIZE = 100_000
+AMOUNT = pa.decimal128(38, 18)
+MAX_AMOUNT = Decimal(10) ** (AMOUNT.precision - AMOUNT.scale)
+
+SCHEMA = pa.schema(
+    [
+        ("block_number", pa.int64()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("transaction_hash", pa.string()),
+        ("log_index", pa.int32()),
+        ("vault", pa.string()),
+        ("strategy", pa.string()),
+        ("version", pa.string()),
+        ("month", pa.string()),
+        ("gain", AMOUNT),
+        ("loss", AMOUNT),
+        ("debt_paid", AMOUNT),
+        ("total_gain", AMOUNT),
+        ("total_loss", AMOUNT),
+        ("total_debt", AMOUNT),
+        ("debt_added", AMOUNT),
+        ("debt_ratio", pa.int32()),
+        ("management_fee_bps", pa.int32()),
+        ("performance_fee_bps", pa.int32()),
+        ("strategist_fee_bps", pa.int32()),
+        ("management_fee", AMOUNT),
+        ("performance_fee", AMOUNT),
+        ("strategist_fee", AMOUNT),
+        ("duration", pa.int64()),
+        ("method", pa.string()),
+        ("verified", pa.bool_()),
+    ]
+)
+PARTITIONING = ds.partitioning(
+    pa.schema([("version", pa.string()), ("month", pa.string())]), flavor="hive"
+)
+
+
+def exported_keys(root: Path) -> Set[Tuple[int, int]]:
+    if not root.exists():
+        return set()
+
+    dataset = ds.dataset(root, format="parquet", partitioning=PARTITIONING)
+    table = dataset.to_table(columns=["block_number", "log_index"])
+    return set(zip(table["block_number"].to_pylist(), table["log_index"].to_pylist()))
+
+
+def fetch_rows(keys: List[Tuple[int, int]]) -> List[Dict]:
+    """
+    Fetch rows for keys with a single query over their blocks.
+    """
+    blocks = list({block for block, _ in keys})
+    wanted = set(keys)
+    with db_session:
+        rows = select(r for r in Report if r.block_number in blocks)
+        return [row.to_dict() for row in rows if (row.block_number, row.log_index) in wanted]
+
+
+def check_amounts(row: Dict):
+    for field in SCHEMA:
+        value = row.get(field.name)
+        if field.type == AMOUNT and value is not None and abs(value) >= MAX_AMOUNT:
+            raise ValueError(
+                f"{field.name} doesn't fit {AMOUNT}",
+                value,
+                (row["block_number"], row["log_index"]),
+            )
+
+
+def to_table(rows: List[Dict]) -> pa.Table:
+    for row in rows:
+        check_amounts(row)
+        row["month"] = row["timestamp"].strftime("%Y-%m")
+
+    return pa.Table.from_pydict(
+        {field.name: [row.get(field.name) for row in rows] for field in SCHEMA}, schema=SCHEMA
+    )
+
+
+def export(root=EXPORT_PATH, batch_size=BATCH_SIZE) -> int:
+    """
+    Append the reports missing from the export and return the number of rows written.
+    """
+    root = Path(root)
+    exported = exported_keys(root)
+    with db_session:
+        keys = set(select((r.block_number, r.log_index) for r in Report))
+    missing = sorted(keys - exported)
+
+    for batch in partition_all(batch_size, missing):
+        table = to_table(fetch_rows(batch))
+        # unique per run, the same block range can be appended to later
+        basename = f"part-{batch[0][0]}-{batch[-1][0]}-{uuid4().hex[:8]}-{{i}}.parquet"
+        ds.write_dataset(
+            table,
+            root,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=basename,
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    return len(missing)
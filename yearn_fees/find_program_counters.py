@@ -4,13 +4,17 @@ import click
 from rich import print
 
 
-def map_source(data):
+def map_source(data, quiet=False):
+    """
+    Find program counters of jumps within `_assessFees`, printing the matching source unless quiet.
+    """
     source_lines = data["source"].splitlines()
     jump_map = data["source_map"]["pc_jump_map"]
     pos_map = data["source_map"]["pc_pos_map"]
     ast = data["ast"]["ast"]["body"]
     api_version = data["api_version"]
-    print(f"[bold yellow]{api_version}[/]")
+    if not quiet:
+        print(f"[bold yellow]{api_version}[/]")
 
     fn = next(item for item in ast if item.get("name") == "_assessFees")
     found_pcs = []
@@ -22,6 +26,8 @@ def map_source(data):
             continue
 
         found_pcs.append(int(pc))
+        if quiet:
+            continue
 
         for row, line in enumerate(source_lines[start_line:end_line], start_line):
             lineno = f"[dim]{row}[/]  "
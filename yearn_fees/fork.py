@@ -1,61 +1,153 @@
-import json
-from typing import List, Optional
+import atexit
+import os
+import socket
+import subprocess
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from time import sleep
+from typing import List
 
-from ape import chain, config, networks
-from ape_foundry.providers import FoundryForkConfig
-from ape_vyper import compiler
-from ethpm_types import ContractType
-from rich import print
+from ape import chain
+from hexbytes import HexBytes
+from web3 import HTTPProvider, Web3
 
-from yearn_fees import compile_sources, utils
-from yearn_fees.cache import cache
+from yearn_fees import compilation, node, utils
 from yearn_fees.types import Fees
 
+FORK_URL = os.environ.get("YEARN_FEES_FORK_URL", "http://127.0.0.1:8545")
+POOL_SIZE = int(os.environ.get("YEARN_FEES_FORK_POOL", 4))
+# replay the block on anvil or simulate only the harvest tx on the upstream node
+FORK_MODE = os.environ.get("YEARN_FEES_FORK_MODE", "replay")
+FORK_MODES = ["replay", "call"]
 
-class SourceContractType(ContractType):
-    source: str
-    code: Optional[str]
-
-    @classmethod
-    def from_file(cls, path):
-        return cls(source=open(path).read())
-
-    def __eq__(self, other):
-        assert isinstance(other, SourceContractType)
-        return self.source == other.source
-
-
-def compile_version(version):
-    key = f"sources:{version}"
-    source_path = f"sources/Vault_v{version}.vy"
-    latest_source = SourceContractType.from_file(source_path)
-    cached_source = cache.get(key)
-    if cached_source:
-        if cached_source == latest_source:
-            return cached_source
-
-    print(f"[yellow]compiling [bold]{source_path}[/]")
-    pragma_spec = compiler.get_pragma_spec(latest_source.source)
-    vyper_version = compile_sources.install_vyper(pragma_spec)
-    vyper_binary = compile_sources.get_executable(vyper_version)
-    formats = ["bytecode_runtime", "abi"]
-    stdoutdata, stderrdata, command, proc = compile_sources.vyper_wrapper(
-        vyper_binary=vyper_binary,
-        source_files=source_path,
-        f=",".join(formats),
-    )
-    code, abi = stdoutdata.splitlines()
 
-    source = SourceContractType(
-        source=latest_source.source,
-        code=code,
-        abi=json.loads(abi),
-    )
-    cache[key] = source
-    return source
+def find_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AnvilFork:
+    """
+    A warm anvil process which can be moved between fork blocks.
+
+    Moving to a new block uses `anvil_reset`, while reusing the same block reverts to a snapshot.
+    """
+
+    def __init__(self, fork_url=FORK_URL):
+        self.fork_url = fork_url
+        self.port = None
+        self.process = None
+        self.block_number = None
+        self.snapshot = None
+        self.w3 = None
+
+    def start(self, block_number):
+        self.port = find_free_port()
+        self.process = subprocess.Popen(
+            [
+                "anvil",
+                "--port", str(self.port),
+                "--fork-url", self.fork_url,
+                "--fork-block-number", str(block_number),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )  # fmt: skip
+        uri = f"http://127.0.0.1:{self.port}"
+        self.w3 = Web3(HTTPProvider(uri, request_kwargs={"timeout": 600}))
+        for _ in range(100):
+            try:
+                self.request("eth_chainId", [])
+                break
+            except Exception:
+                sleep(0.1)
+        else:
+            raise RuntimeError(f"anvil didn't start at {uri}")
+
+        self.block_number = block_number
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    def request(self, method, params):
+        response = self.w3.provider.make_request(method, params)
+        if "error" in response:
+            raise RuntimeError(method, response["error"])
+        return response["result"]
+
+    def at_block(self, block_number):
+        """
+        Put the fork at a clean state of `block_number`.
+        """
+        if self.process is None:
+            self.start(block_number)
+        elif self.block_number == block_number and self.snapshot is not None:
+            self.request("evm_revert", [self.snapshot])
+        else:
+            self.request(
+                "anvil_reset",
+                [{"forking": {"jsonRpcUrl": self.fork_url, "blockNumber": block_number}}],
+            )
+            self.block_number = block_number
+
+        # a snapshot can only be reverted to once
+        self.snapshot = self.request("evm_snapshot", [])
 
 
-def fork_tx(tx) -> List[Fees]:
+class ForkPool:
+    """
+    Hands out anvil forks to concurrent callers, preferring a fork already at the requested block.
+    """
+
+    def __init__(self, size=POOL_SIZE, fork_url=FORK_URL):
+        self.forks = [AnvilFork(fork_url) for _ in range(size)]
+        self.idle = list(self.forks)
+        self.condition = threading.Condition()
+        atexit.register(self.close)
+
+    @contextmanager
+    def acquire(self, block_number):
+        with self.condition:
+            while not self.idle:
+                self.condition.wait()
+            fork = next((f for f in self.idle if f.block_number == block_number), self.idle[0])
+            self.idle.remove(fork)
+
+        try:
+            fork.at_block(block_number)
+            yield fork
+        finally:
+            with self.condition:
+                # the least recently used fork is picked first when there is no match
+                self.idle.append(fork)
+                self.condition.notify()
+
+    def close(self):
+        for fork in self.forks:
+            fork.stop()
+
+
+@lru_cache(maxsize=None)
+def get_pool() -> ForkPool:
+    return ForkPool()
+
+
+@node.needs_node
+def fork_tx(tx, mode=None) -> List[Fees]:
+    """
+    Recover fees by running a harvest with vault bytecode patched to emit a `Fees` event.
+    """
+    mode = mode or FORK_MODE
+    if mode == "call":
+        return simulate_tx(tx)
+    if mode != "replay":
+        raise ValueError("unsupported fork mode", mode)
+
     receipt = chain.provider.get_transaction(tx)
     timestamp = chain.blocks[receipt.block_number].timestamp
     block_transactions = chain.blocks[receipt.block_number].transactions
@@ -66,46 +158,36 @@ def fork_tx(tx) -> List[Fees]:
     results = []
 
     # fork at a previous block
-    config._plugin_configs["foundry"].port = 7545
-    config._plugin_configs["foundry"].fork = {
-        "ethereum": {
-            "mainnet": FoundryForkConfig(
-                upstream_provider="geth",
-                block_number=receipt.block_number - 1,
-            )
-        }
-    }
-
-    with networks.ethereum.mainnet_fork.use_provider("foundry"):
+    with get_pool().acquire(receipt.block_number - 1) as fork:
         contracts = {}
         # replace runtime bytecode
         for report, version in zip(reports, versions):
-            contracts[version] = compile_version(version)
-            chain.provider._make_request(
-                "anvil_setCode", [report.contract_address, contracts[version].code]
-            )
+            contracts[version] = compilation.compile_version(version)
+            fork.request("anvil_setCode", [report.contract_address, contracts[version].code])
 
         # disable automine so all transactions end up in the same block
-        chain.provider._make_request("evm_setAutomine", [False])
-        chain.pending_timestamp = timestamp
+        fork.request("evm_setAutomine", [False])
+        fork.request("evm_setNextBlockTimestamp", [timestamp])
 
         # replay the block till our transaction
         for txn in block_transactions[:tx_index]:
-            chain.provider.web3.eth.send_raw_transaction(txn.serialize_transaction())
+            raw_tx = HexBytes(txn.serialize_transaction()).hex()
+            fork.request("eth_sendRawTransaction", [raw_tx])
 
         # replay tx with higher gas limit to accommodate logs
         replay_tx = block_transactions[tx_index]
         replay_tx.gas_limit += 100_000
         replay_tx.chain_id = chain.chain_id  # ape bug?
-        chain.provider.unlock_account(replay_tx.sender)
-        replay_tx_hash = chain.provider.web3.eth.send_transaction(replay_tx.dict())
+        fork.request("anvil_impersonateAccount", [replay_tx.sender])
+        replay_tx_hash = fork.w3.eth.send_transaction(replay_tx.dict())
 
         # advance one block and make sure we at the original height and timestamp
-        chain.mine()
-        assert chain.blocks.head.timestamp == timestamp
-        assert chain.blocks.height == receipt.block_number
+        fork.request("evm_mine", [])
+        head = fork.w3.eth.get_block("latest")
+        assert head.timestamp == timestamp
+        assert head.number == receipt.block_number
 
-        fork_receipt = chain.provider.web3.eth.get_transaction_receipt(replay_tx_hash)
+        fork_receipt = fork.w3.eth.get_transaction_receipt(replay_tx_hash)
         fork_logs = fork_receipt["logs"]
         assert fork_receipt["status"], "tx failed"
 
@@ -121,3 +203,91 @@ def fork_tx(tx) -> List[Fees]:
             results.append(Fees.parse_obj(event.event_arguments))
 
     return results
+
+
+def flatten_logs(frame) -> List[dict]:
+    """
+    Collect logs from a `callTracer` frame in execution order.
+    A log's `position` is the number of subcalls made before it was emitted.
+    """
+    logs = frame.get("logs") or []
+    calls = frame.get("calls") or []
+    result = []
+    for i, call in enumerate(calls):
+        result.extend(log for log in logs if log.get("position", 0) == i)
+        result.extend(flatten_logs(call))
+    result.extend(log for log in logs if log.get("position", 0) >= len(calls))
+    for log in result:
+        log.setdefault("address", frame.get("to"))
+
+    return result
+
+
+@node.needs_node
+def simulate_tx(tx) -> List[Fees]:
+    """
+    Re-execute only the harvest tx with the patched bytecode injected by a state override.
+
+    Uses `debug_traceCallMany` at the tx's position in the block, so the state includes the
+    preceding txs and the block context matches without replaying them.
+    """
+    receipt = chain.provider.get_transaction(tx)
+    block = chain.blocks[receipt.block_number]
+    tx_index = next(i for i, x in enumerate(block.transactions) if x.txn_hash.hex() == tx)
+    harvest = block.transactions[tx_index]
+
+    reports = utils.reports_from_tx(tx)
+    versions = [utils.version_from_report(r) for r in reports]
+    contracts = {version: compilation.compile_version(version) for version in versions}
+    overrides = {
+        report.contract_address: {"code": contracts[version].code}
+        for report, version in zip(reports, versions)
+    }
+
+    call = {
+        "from": harvest.sender,
+        "to": harvest.receiver,
+        "data": HexBytes(harvest.data).hex(),
+        "value": hex(harvest.value),
+        # leave room for the extra logs
+        "gas": hex(harvest.gas_limit + 100_000),
+    }
+    config = {
+        "tracer": "callTracer",
+        "tracerConfig": {"withLog": True},
+        "stateOverrides": overrides,
+    }
+    context = {"blockNumber": hex(receipt.block_number), "transactionIndex": tx_index}
+    response = chain.provider._make_request(
+        "debug_traceCallMany", [[{"transactions": [call]}], context, config]
+    )
+    frame = response[0][0]
+    assert not frame.get("error"), f"tx failed: {frame.get('error')}"
+
+    fork_logs = [
+        {
+            **log,
+            "logIndex": i,
+            "blockNumber": receipt.block_number,
+            "blockHash": block.hash,
+            "transactionHash": tx,
+            "transactionIndex": tx_index,
+        }
+        for i, log in enumerate(flatten_logs(frame))
+    ]
+
+    results = []
+    for report, version in zip(reports, versions):
+        contract_logs = [
+            log for log in fork_logs if log["address"].lower() == report.contract_address.lower()
+        ]
+        event = next(
+            chain.provider.network.ecosystem.decode_logs(
+                contracts[version].events["Fees"], contract_logs
+            )
+        )
+        # offset the remaining logs so we don't read the same log twice
+        fork_logs = [log for log in fork_logs if log["logIndex"] > event.log_index]
+        results.append(Fees.parse_obj(event.event_arguments))
+
+    return results
@@ -5,8 +5,9 @@ from collections import Counter
 from datetime import datetime, timezone
 from decimal import Decimal
 from enum import Enum
+from time import perf_counter
 
-from ape import chain, networks
+from ape import chain
 from dask import distributed
 from rich.console import Console
 from rich.progress import (
@@ -18,12 +19,26 @@ from rich.progress import (
 )
 from toolz import unique
 
-from yearn_fees import utils
+from yearn_fees import (
+    archive,
+    cache_server,
+    metrics,
+    node,
+    retries,
+    rollups,
+    segmented,
+    utils,
+    verification,
+)
 from yearn_fees.assess import assess_fees
-from yearn_fees.models import ObjectNotFound, Report, bind_db, db_session, select
+from yearn_fees.cache import CACHE_BACKEND
+from yearn_fees.compare import compare_as_table
+from yearn_fees.models import ObjectNotFound, Report, bind_db, db, db_session, select
+from yearn_fees.profiling import profile
 from yearn_fees.traces import fees_from_trace
 
-FORBIDDEN_TXS = [
+# these break a full trace, they are retrieved in segments instead
+GIANT_TXS = [
     # https://github.com/ledgerwatch/erigon/issues/4637
     "0xb9e6b6f275212824215e8f50818f12b37b7ca4c2e0b943785357c35b23743b94",
     "0xd770356649f1e60e7342713d483bd8946f967e544db639bd056dfccc8d534d8e",
@@ -41,8 +56,11 @@ class WorkerConnection(distributed.WorkerPlugin):
     def setup(self, worker):
         silence_loggers()
         bind_db()
-        networks.ethereum.mainnet.use_default_provider().__enter__()
-        chain.provider.web3.provider._request_kwargs["timeout"] = 600
+        # the offline mode reads everything from an archive
+        if archive.get_archive():
+            return
+        node.connect()
+        chain.provider.web3.middleware_onion.add(metrics.rpc_counter_middleware)
 
 
 def silence_loggers():
@@ -65,6 +83,10 @@ def get_unindexed_txs():
     Find all transaction hashes which have unindexed reports.
     """
     reports = utils.get_reports()
+    # an archive holds all reports but can be exported for only some of the txs
+    offline = archive.get_archive()
+    if offline:
+        reports = [report for report in reports if report.transaction_hash.hex() in offline.index]
     unindexed_reports = {(report.block_number, report.log_index): report for report in reports}
 
     with db_session:
@@ -81,9 +103,13 @@ def get_unindexed_txs():
     return unindexed_txs
 
 
-def start():
+def start_cluster(n_workers=4, metrics_file=None, metrics_port=None):
+    # workers share one cache process instead of the sqlite file
+    if CACHE_BACKEND == "server":
+        cache_server.ensure_running()
+
     # start a dask cluster, lower n_workers if you run out of memory
-    cluster = distributed.LocalCluster(n_workers=4, threads_per_worker=1)
+    cluster = distributed.LocalCluster(n_workers=n_workers, threads_per_worker=1)
     client = distributed.Client(cluster)
     client.register_worker_plugin(WorkerConnection())
     silence_loggers()
@@ -92,11 +118,19 @@ def start():
     console = Console(log_path=False)
     threading.Thread(target=console_thread, args=(console,), daemon=True).start()
 
+    # aggregate worker metrics in the main process
+    aggregator = metrics.MetricsAggregator(metrics_file)
+    threading.Thread(target=metrics.metrics_thread, args=(aggregator,), daemon=True).start()
+    if metrics_port:
+        metrics.serve(aggregator, metrics_port)
+        log(f"metrics at http://127.0.0.1:{metrics_port}/metrics")
+
     log(client.dashboard_link)
 
-    unindexed_txs = client.submit(get_unindexed_txs).result()
-    tasks = client.map(load_transaction, unindexed_txs)
+    return client, console
+
 
+def track_tasks(tasks, console, description):
     progress = Progress(
         TimeElapsedColumn(),
         BarColumn(),
@@ -105,25 +139,134 @@ def start():
         console=console,
     )
     with progress:
-        task = progress.add_task("index txs", total=len(unindexed_txs))
-        for result in distributed.as_completed(tasks):
+        task = progress.add_task(description, total=len(tasks))
+        for future in distributed.as_completed(tasks):
+            if future.status == "error":
+                log(f"[bold red]task failed[/] {future.key} {future.exception()!r}")
             progress.update(task, advance=1)
 
 
-def load_transaction(tx):
+def plan_transactions(txs, measurements, n_workers):
+    """
+    Order txs largest first and move probable pathological traces to the dead-letter queue.
+    """
+    from yearn_fees import planner
+
+    # one report fetch for both the measurements and the plan
+    signals = planner.tx_signals(utils.get_reports())
+    model = planner.CostModel(planner.load_measurements(signals, measurements))
+    plan = planner.make_plan(txs, model, signals, n_workers=n_workers)
+    planner.store_predictions(plan.predictions + plan.flagged)
+    for prediction in plan.flagged:
+        retries.record(prediction.tx, retries.Reason.flagged, error=f"{prediction.frames} frames")
+
+    log(f"[yellow]flagged {utils.plural('tx', len(plan.flagged))}, eta {plan.eta / 3600:.1f}h")
+    # txs without a prediction keep their original order at the end
+    planned = set(plan.order) | {prediction.tx for prediction in plan.flagged}
+    return plan.order + [tx for tx in txs if tx not in planned]
+
+
+def start(metrics_file=None, metrics_port=None, policy=verification.STRICT, measurements=None):
+    n_workers = 4
+    client, console = start_cluster(n_workers, metrics_file=metrics_file, metrics_port=metrics_port)
+
+    unindexed_txs = client.submit(get_unindexed_txs).result()
+    # decode reports from batched receipts instead of one receipt per task
+    client.submit(utils.prefetch_reports, unindexed_txs).result()
+    if measurements:
+        unindexed_txs = client.submit(
+            plan_transactions, unindexed_txs, measurements, n_workers
+        ).result()
+
+    # earlier txs in the plan are larger, so they get a higher priority
+    tasks = [
+        client.submit(load_transaction, tx, policy=policy, priority=len(unindexed_txs) - i)
+        for i, tx in enumerate(unindexed_txs)
+    ]
+    track_tasks(tasks, console, "index txs")
+
+
+def retry_dropped(limit=None, due_only=True, n_workers=4):
+    """
+    Pull txs from the dead-letter queue and index them again in parallel.
+    """
+    client, console = start_cluster(n_workers)
+
+    txs = client.submit(retries.pending, limit, due_only).result()
+    log(f"[yellow]retry {utils.plural('dropped tx', len(txs))}")
+    # pure=False allows retrying the same tx within one session
+    tasks = client.map(load_transaction, txs, pure=False)
+    track_tasks(tasks, console, "retry txs")
+
+
+@profile(lambda tx, *args, **kwargs: tx)
+def load_transaction(tx, policy=verification.STRICT):
     """
     Index and load all reports from a transaction into the database.
+    The policy decides which methods run for each report.
+    Dropped and failed txs are recorded in the dead-letter queue.
     """
-    if tx in FORBIDDEN_TXS:
-        log(f"[bold red]forbidden tx {tx}")
+    start_time = perf_counter()
+    try:
+        with metrics.collect(tx) as tx_metrics:
+            stats, mismatches = index_transaction(tx, policy)
+    except Exception as e:
+        log(f"[bold red]failed at {tx}[/] {e!r}")
+        retries.record(tx, retries.Reason.error, error=repr(e), elapsed=perf_counter() - start_time)
         return
 
-    reports = utils.reports_from_tx(tx)
-    traces = utils.get_split_trace(tx)
+    tx_metrics.stages["total"] = perf_counter() - start_time
+    tx_metrics.reports.update({stat.name: num for stat, num in stats.items()})
+    metrics.publish(tx_metrics)
+
+    if mismatches:
+        retries.record(
+            tx, retries.Reason.mismatch, elapsed=perf_counter() - start_time, fees=mismatches
+        )
+    else:
+        retries.resolve(tx)
+
+    stats = [
+        f'[{stat.value}]{stat.name} {utils.plural("report", num)}[/]'
+        for stat, num in stats.most_common()
+    ]
+    log(f"{', '.join(stats)} [yellow]at {tx}[/]")
+
+
+def get_split_trace(tx, reports):
+    """
+    Get a full trace, or re-execute in segments if it's too large or the full trace fails.
+    """
+    if archive.get_archive():
+        return utils.get_split_trace(tx)
+    if tx in GIANT_TXS or segmented.is_giant(tx):
+        return segmented.get_split_trace(tx, reports)
+
+    try:
+        return utils.get_split_trace(tx, reports=reports)
+    except segmented.RETRYABLE as e:
+        log(f"[yellow]full trace failed at {tx}[/] {e!r}, retrying in segments")
+        return segmented.get_split_trace(tx, reports)
+
+
+def index_transaction(tx, policy=verification.STRICT):
+    with metrics.stage("reports"):
+        reports = utils.reports_from_tx(tx)
+        versions = [utils.version_from_report(report) for report in reports]
+    plans = [policy.plan(version) for version in versions]
+
+    # only fetch the trace if any of the reports needs it
+    if any(run_trace for run_assess, run_trace in plans):
+        # includes trace_fetch and trace_parse
+        with metrics.stage("trace"):
+            traces = get_split_trace(tx, reports)
+    else:
+        traces = [None] * len(reports)
 
     stats = Counter()
+    mismatches = []
 
-    for report, trace in zip(reports, traces):
+    for report, trace, version, (run_assess, run_trace) in zip(reports, traces, versions, plans):
         with db_session:
             try:
                 Report[report.block_number, report.log_index]
@@ -133,26 +276,51 @@ def load_transaction(tx):
                 stats[Status.skipped] += 1
                 continue
 
-        timestamp = chain.blocks[report.block_number].timestamp
-        version = utils.version_from_report(report)
-        decimals = utils.get_decimals(report.contract_address)
-        scale = 10**decimals
-
-        fee_config = utils.get_fee_config_at_report(report)
-        fees_assess = assess_fees(report)
-        fees_trace = fees_from_trace(trace, version)
+        with metrics.stage("metadata"):
+            timestamp = utils.get_timestamp(report.block_number)
+            decimals = utils.get_decimals(report.contract_address)
+            scale = 10**decimals
+
+        with metrics.stage("fee_config"):
+            fee_config = utils.get_fee_config_at_report(report)
+        fees_assess = fees_trace = None
+        if run_assess:
+            with metrics.stage("assess"):
+                fees_assess = assess_fees(report)
+        if run_trace:
+            with metrics.stage("fees_from_trace"):
+                fees_trace = fees_from_trace(trace, version, tx)
         # some versions can't get an accurate duration from trace
-        if fees_trace.duration is None:
+        if fees_trace and fees_trace.duration is None:
             fees_trace.duration = fees_assess.duration
 
-        if fees_assess != fees_trace:
+        verified = run_assess and run_trace
+        # mismatches are counted once per tx when they enter the dead-letter queue
+        mismatch = verified and fees_assess != fees_trace
+
+        if mismatch:
             log(f"[red]mismatch at {tx}")
-            log(fees_assess.compare(fees_trace, decimals, output=False))
+            log(
+                compare_as_table(
+                    {"assess": fees_assess, "trace": fees_trace}, decimals, output=False
+                )
+            )
+            mismatches.append(
+                {
+                    "log_index": report.log_index,
+                    "version": version,
+                    "assess": fees_assess.dict(),
+                    "trace": fees_trace.dict(),
+                }
+            )
             stats[Status.dropped] += 1
             continue
 
-        with db_session:
-            Report(
+        fees = fees_assess or fees_trace
+        method = verification.Method.assess if fees_assess else verification.Method.trace
+
+        with metrics.stage("db"), db_session:
+            row = Report(
                 block_number=report.block_number,
                 timestamp=datetime.fromtimestamp(timestamp, timezone.utc),
                 transaction_hash=report.transaction_hash.hex(),
@@ -171,15 +339,18 @@ def load_transaction(tx):
                 management_fee_bps=fee_config.management_fee,
                 performance_fee_bps=fee_config.performance_fee,
                 strategist_fee_bps=fee_config.strategist_fee,
-                management_fee=Decimal(fees_assess.management_fee) / scale,
-                performance_fee=Decimal(fees_assess.performance_fee) / scale,
-                strategist_fee=Decimal(fees_assess.strategist_fee) / scale,
-                duration=fees_assess.duration,
+                management_fee=Decimal(fees.management_fee) / scale,
+                performance_fee=Decimal(fees.performance_fee) / scale,
+                strategist_fee=Decimal(fees.strategist_fee) / scale,
+                duration=fees.duration,
+                method=method.value,
+                verified=verified,
             )
+            rollups.add_report(row)
+            if verified:
+                verification.record_verification(version, mismatch=False)
+            # delivered on commit, clears the api cache
+            db.execute("notify reports")
             stats[Status.loaded] += 1
 
-    stats = [
-        f'[{stat.value}]{stat.name} {utils.plural("report", num)}[/]'
-        for stat, num in stats.most_common()
-    ]
-    log(f"{', '.join(stats)} [yellow]at {tx}[/]")
+    return stats, mismatches
@@ -49,7 +49,7 @@ class MemoryLayout(dict):
             for key, value in MEMORY_LAYOUT[version]["_assessFees"].items()
             if key not in ["#internal_0", "strategy"]
         }
-        self._program_coutners = PROGRAM_COUNTERS[version]
+        self._program_coutners = frozenset(PROGRAM_COUNTERS[version])
 
         for frame in trace:
             if frame.pc not in self._program_coutners:
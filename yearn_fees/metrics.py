@@ -0,0 +1,207 @@
+"""
+Structured per-stage metrics for the indexer.
+
+Workers collect timings and counters for each tx and publish them to the main process,
+which aggregates them, appends them to a json-lines file and serves them in prometheus format.
+"""
+
+import json
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, time
+from typing import Optional
+
+from dask import distributed
+
+_current: ContextVar[Optional["Metrics"]] = ContextVar("metrics", default=None)
+
+
+class Metrics:
+    """
+    Timings and counters collected while indexing a single tx.
+    """
+
+    def __init__(self, tx):
+        self.tx = tx
+        self.stages = Counter()
+        self.counters = Counter()
+        self.rpc_calls = Counter()
+        self.reports = Counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += perf_counter() - start
+
+    def as_dict(self):
+        return {
+            "tx": self.tx,
+            "time": time(),
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "rpc_calls": dict(self.rpc_calls),
+            "reports": dict(self.reports),
+        }
+
+
+@contextmanager
+def collect(tx):
+    """
+    Make a `Metrics` instance current for the duration of the block.
+    """
+    metrics = Metrics(tx)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def current() -> Optional[Metrics]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+
+    with metrics.stage(name):
+        yield
+
+
+def add_time(name, seconds):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.stages[name] += seconds
+
+
+def add_count(name, value=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.counters[name] += value
+
+
+def rpc_counter_middleware(make_request, w3):
+    """
+    A web3 middleware which counts rpc calls by method.
+    """
+
+    def middleware(method, params):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.rpc_calls[method] += 1
+        return make_request(method, params)
+
+    return middleware
+
+
+def publish(metrics: Metrics):
+    distributed.Pub("metrics").put(metrics.as_dict())
+
+
+class MetricsAggregator:
+    """
+    Aggregates metrics published by the workers.
+    """
+
+    def __init__(self, path=None):
+        self.started = perf_counter()
+        self.txs = 0
+        self.stage_seconds = Counter()
+        self.stage_count = Counter()
+        self.counters = Counter()
+        self.rpc_calls = Counter()
+        self.reports = Counter()
+        self.lock = threading.Lock()
+        self.file = open(path, "at") if path else None
+
+    def add(self, record):
+        with self.lock:
+            self.txs += 1
+            for name, seconds in record["stages"].items():
+                self.stage_seconds[name] += seconds
+                self.stage_count[name] += 1
+            self.counters.update(record["counters"])
+            self.rpc_calls.update(record["rpc_calls"])
+            self.reports.update(record["reports"])
+
+            if self.file:
+                self.file.write(json.dumps(record) + "\n")
+                self.file.flush()
+
+    @property
+    def reports_per_second(self):
+        return sum(self.reports.values()) / (perf_counter() - self.started)
+
+    def prometheus(self) -> str:
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append(f"# TYPE yearn_fees_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"yearn_fees_{name}{labels} {value}")
+
+        with self.lock:
+            metric("txs_total", "counter", [("", self.txs)])
+            metric(
+                "reports_total",
+                "counter",
+                [(f'{{status="{status}"}}', num) for status, num in self.reports.items()],
+            )
+            metric("reports_per_second", "gauge", [("", f"{self.reports_per_second:.3f}")])
+            lines.append("# TYPE yearn_fees_stage_seconds summary")
+            for name in self.stage_seconds:
+                lines.append(
+                    f'yearn_fees_stage_seconds_sum{{stage="{name}"}} {self.stage_seconds[name]:.6f}'
+                )
+                lines.append(
+                    f'yearn_fees_stage_seconds_count{{stage="{name}"}} {self.stage_count[name]}'
+                )
+            metric(
+                "rpc_calls_total",
+                "counter",
+                [(f'{{method="{method}"}}', num) for method, num in self.rpc_calls.items()],
+            )
+            for name, value in self.counters.items():
+                metric(f"{name}_total", "counter", [("", value)])
+
+        return "\n".join(lines) + "\n"
+
+
+def metrics_thread(aggregator: MetricsAggregator):
+    for record in distributed.Sub("metrics"):
+        aggregator.add(record)
+
+
+def serve(aggregator: MetricsAggregator, port: int):
+    """
+    Serve aggregated metrics in prometheus text format at /metrics.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = aggregator.prometheus().encode()
+            self.send_response(200)
+            self.send_header("content-type", "text/plain; version=0.0.4")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
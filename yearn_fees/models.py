@@ -4,11 +4,13 @@ from decimal import Decimal
 
 from pony.orm import (
     Database,
+    Json,
     ObjectNotFound,
     Optional,
     PrimaryKey,
     Required,
     db_session,
+    desc,
     select,
 )
 
@@ -19,12 +21,12 @@ class Report(db.Entity):
     _table_ = "reports"
     # position
     block_number = Required(int)
-    timestamp = Required(datetime, sql_type="timestamptz")
-    transaction_hash = Required(str)
+    timestamp = Required(datetime, sql_type="timestamptz", index=True)
+    transaction_hash = Required(str, index=True)
     log_index = Required(int)
     # log
-    vault = Required(str)
-    strategy = Required(str)
+    vault = Required(str, index=True)
+    strategy = Required(str, index=True)
     version = Required(str)
     # report
     gain = Required(Decimal, sql_type="numeric")
@@ -44,17 +46,100 @@ class Report(db.Entity):
     performance_fee = Required(Decimal, sql_type="numeric")
     strategist_fee = Required(Decimal, sql_type="numeric")
     duration = Required(int)
+    # verification
+    method = Optional(str)
+    verified = Optional(bool)
 
     PrimaryKey(block_number, log_index)
 
 
+class FeeRollup(db.Entity):
+    _table_ = "fee_rollups"
+    # vault, strategy or version
+    scope = Required(str)
+    key = Required(str)
+    # day or month
+    grain = Required(str)
+    period = Required(datetime, sql_type="timestamptz")
+    reports = Required(int, default=0)
+    gain = Required(Decimal, sql_type="numeric", default=0)
+    loss = Required(Decimal, sql_type="numeric", default=0)
+    management_fee = Required(Decimal, sql_type="numeric", default=0)
+    performance_fee = Required(Decimal, sql_type="numeric", default=0)
+    strategist_fee = Required(Decimal, sql_type="numeric", default=0)
+    duration = Required(int, size=64, default=0)
+
+    PrimaryKey(scope, key, grain, period)
+
+
+class TracePrediction(db.Entity):
+    _table_ = "trace_predictions"
+    transaction_hash = PrimaryKey(str)
+    gas_used = Required(int)
+    frames = Required(int, size=64)
+    bytes = Required(int, size=64)
+    seconds = Required(float)
+    flagged = Required(bool)
+    updated = Required(datetime, sql_type="timestamptz")
+
+
+class VersionStats(db.Entity):
+    _table_ = "version_stats"
+    version = PrimaryKey(str)
+    verified = Required(int, default=0)
+    mismatched = Required(int, default=0)
+
+
+class DroppedTx(db.Entity):
+    _table_ = "dropped_txs"
+    transaction_hash = PrimaryKey(str)
+    # why it was dropped
+    reason = Required(str)
+    error = Optional(str, nullable=True)
+    # retry schedule
+    priority = Required(int, default=0)
+    attempts = Required(int, default=0)
+    next_attempt = Required(datetime, sql_type="timestamptz")
+    updated = Required(datetime, sql_type="timestamptz")
+    resolved = Required(bool, default=False)
+    # last attempt
+    elapsed = Optional(float)
+    fees = Optional(Json)
+
+
+def connection_params():
+    return {
+        "user": os.environ.get("PGUSER", "postgres"),
+        "host": os.environ.get("PGHOST", "127.0.0.1"),
+        "password": os.environ.get("PGPASS", None),
+        "database": "yearn-fees",
+    }
+
+
+# columns added to existing tables, pony only creates columns together with the table
+MIGRATIONS = [
+    "alter table if exists reports add column if not exists method text",
+    "alter table if exists reports add column if not exists verified boolean",
+]
+
+
+def migrate():
+    import psycopg2
+
+    params = connection_params()
+    params["dbname"] = params.pop("database")
+    conn = psycopg2.connect(**params)
+    try:
+        with conn, conn.cursor() as cursor:
+            for statement in MIGRATIONS:
+                cursor.execute(statement)
+    finally:
+        conn.close()
+
+
 def bind_db():
-    db.bind(
-        provider="postgres",
-        user=os.environ.get("PGUSER", "postgres"),
-        host=os.environ.get("PGHOST", "127.0.0.1"),
-        password=os.environ.get("PGPASS", None),
-        database="yearn-fees",
-    )
+    db.bind(provider="postgres", **connection_params())
+    # before mapping, which checks the columns of existing tables
+    migrate()
 
     db.generate_mapping(create_tables=True)
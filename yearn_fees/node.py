@@ -0,0 +1,44 @@
+"""
+A lazy mainnet connection.
+
+Lookups which read from a node are wrapped with `needs_node`, so commands served from the cache
+or an archive never start a provider. Keep it below `cache.memoize` so only misses connect.
+"""
+
+import threading
+from functools import wraps
+
+from yearn_fees import archive
+
+_lock = threading.Lock()
+_connected = False
+
+
+def connect():
+    """
+    Connect to mainnet once per process. Does nothing in offline mode.
+    """
+    global _connected
+
+    if _connected or archive.get_archive():
+        return
+
+    with _lock:
+        if _connected:
+            return
+
+        from ape import chain, networks
+
+        # stays connected for the lifetime of the process
+        networks.ethereum.mainnet.use_default_provider().__enter__()
+        chain.provider.web3.provider._request_kwargs["timeout"] = 600
+        _connected = True
+
+
+def needs_node(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        connect()
+        return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,213 @@
+"""
+Predict trace size, frame count and fetch time of a tx before fetching its trace.
+
+The model is fit on historical measurements from `measure_trace`. It scales gas used by the
+frames per gas seen for the same strategy, falling back to the same version and then all txs.
+"""
+
+import json
+import statistics
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ape import chain
+from rich import box
+from rich.console import Console
+from rich.table import Table
+from toolz import groupby, partition_all
+
+from yearn_fees import node, utils
+from yearn_fees.cache import cache
+from yearn_fees.models import TracePrediction, db_session
+
+MEASUREMENTS = "dropped-trace-sizes.jsonl"
+# traces above this size break erigon, see indexer.GIANT_TXS
+MAX_FRAMES = 20_000_000
+MEMORY_BUDGET = 4 * 2**30
+# a parsed frame takes several times its wire size
+MEMORY_PER_BYTE = 3
+
+
+@dataclass
+class Prediction:
+    tx: str
+    gas_used: int
+    frames: int
+    bytes: int
+    seconds: float
+    flagged: bool = False
+
+
+@cache.memoize()
+@node.needs_node
+def get_gas_used(tx) -> int:
+    return chain.provider.get_transaction(tx).gas_used
+
+
+def prefetch_gas_used(txs, chunk_size=100):
+    """
+    Fill the `get_gas_used` cache for many txs, fetching receipts in batches.
+    """
+    missing = [tx for tx in txs if get_gas_used.__cache_key__(tx) not in cache]
+    for chunk in partition_all(chunk_size, missing):
+        for tx, receipt in utils.fetch_receipts(chunk).items():
+            cache.set(get_gas_used.__cache_key__(tx), int(receipt["gasUsed"], 16), retry=True)
+
+
+def tx_signals(reports) -> Dict[str, Dict]:
+    """
+    Version and strategies of each tx, from the reports without extra rpc calls.
+    """
+    reports = groupby(lambda log: log.transaction_hash.hex(), reports)
+    return {
+        tx: {
+            "version": utils.version_from_report(logs[0]),
+            "strategies": [log.strategy for log in logs],
+        }
+        for tx, logs in reports.items()
+    }
+
+
+def load_measurements(signals: Dict[str, Dict], path=MEASUREMENTS) -> List[Dict]:
+    """
+    Read measurements and enrich them with gas used and the tx signals.
+    """
+    items = [json.loads(line) for line in Path(path).read_text().splitlines()]
+    items = [item for item in items if item["tx"] in signals and item["frames"]]
+    prefetch_gas_used([item["tx"] for item in items])
+    for item in items:
+        item.update(signals[item["tx"]], gas_used=get_gas_used(item["tx"]))
+
+    return items
+
+
+class CostModel:
+    """
+    Median ratios of frames per gas, bytes per frame and seconds per frame
+    by strategy, by version and overall.
+    """
+
+    def __init__(self, measurements: List[Dict]):
+        samples = defaultdict(list)
+        for item in measurements:
+            ratios = (
+                item["frames"] / item["gas_used"],
+                item["bytes_wire"] / item["frames"],
+                item["elapsed"] / item["frames"],
+            )
+            samples["global"].append(ratios)
+            samples[item["version"]].append(ratios)
+            for strategy in item["strategies"]:
+                samples[strategy].append(ratios)
+
+        self.ratios = {
+            key: tuple(statistics.median(column) for column in zip(*values))
+            for key, values in samples.items()
+        }
+
+    def predict(self, tx, gas_used, version, strategies) -> Optional[Prediction]:
+        keys = [*strategies, version, "global"]
+        key = next((key for key in keys if key in self.ratios), None)
+        if key is None:
+            return None
+
+        frames_per_gas, bytes_per_frame, seconds_per_frame = self.ratios[key]
+        frames = int(gas_used * frames_per_gas)
+        return Prediction(
+            tx=tx,
+            gas_used=gas_used,
+            frames=frames,
+            bytes=int(frames * bytes_per_frame),
+            seconds=frames * seconds_per_frame,
+        )
+
+
+@dataclass
+class Plan:
+    predictions: List[Prediction]
+    flagged: List[Prediction]
+    n_workers: int
+
+    @property
+    def eta(self) -> float:
+        # the largest tx bounds the makespan when scheduled first
+        total = sum(p.seconds for p in self.predictions)
+        longest = max((p.seconds for p in self.predictions), default=0)
+        return max(total / self.n_workers, longest)
+
+    @property
+    def order(self) -> List[str]:
+        return [p.tx for p in self.predictions]
+
+
+def make_plan(
+    txs,
+    model: CostModel,
+    signals: Dict[str, Dict],
+    n_workers=4,
+    max_frames=MAX_FRAMES,
+    memory_budget=MEMORY_BUDGET,
+) -> Plan:
+    """
+    Predict costs, flag probable pathological traces and order the rest largest first.
+    """
+    prefetch_gas_used(txs)
+    predictions = []
+    flagged = []
+
+    for tx in txs:
+        signal = signals.get(tx, {"version": None, "strategies": []})
+        prediction = model.predict(tx, get_gas_used(tx), signal["version"], signal["strategies"])
+        if prediction is None:
+            continue
+        # a worker can't hold a trace larger than its share of the memory budget
+        too_large = prediction.bytes * MEMORY_PER_BYTE > memory_budget / n_workers
+        if prediction.frames > max_frames or too_large:
+            prediction.flagged = True
+            flagged.append(prediction)
+        else:
+            predictions.append(prediction)
+
+    predictions.sort(key=lambda p: p.seconds, reverse=True)
+    return Plan(predictions=predictions, flagged=flagged, n_workers=n_workers)
+
+
+def store_predictions(predictions: List[Prediction]):
+    now = datetime.now(timezone.utc)
+    with db_session:
+        for p in predictions:
+            item = TracePrediction.get(transaction_hash=p.tx)
+            values = {key: value for key, value in asdict(p).items() if key != "tx"}
+            if item is None:
+                TracePrediction(transaction_hash=p.tx, updated=now, **values)
+            else:
+                item.set(updated=now, **values)
+
+
+def display_plan(plan: Plan):
+    table = Table(title="trace plan", box=box.SIMPLE)
+    table.add_column("tx")
+    table.add_column("gas used", justify="right")
+    table.add_column("frames", justify="right")
+    table.add_column("size", justify="right")
+    table.add_column("seconds", justify="right")
+
+    for p in plan.flagged + plan.predictions[:10]:
+        style = "[red]" if p.flagged else ""
+        table.add_row(
+            f"{style}{p.tx}",
+            f"{p.gas_used:,d}",
+            f"{p.frames:,d}",
+            f"{p.bytes / 2**20:,.1f} MB",
+            f"{p.seconds:,.1f}",
+        )
+
+    console = Console()
+    console.print(table)
+    console.print(
+        f"{len(plan.predictions)} txs, {len(plan.flagged)} flagged, "
+        f"eta {plan.eta / 3600:.1f}h with {plan.n_workers} workers"
+    )
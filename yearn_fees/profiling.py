@@ -0,0 +1,165 @@
+"""
+Opt-in sampling profiler for the expensive parts of the pipeline.
+
+Enable with `YEARN_FEES_PROFILE=1` or `yearn-fees --profile <command>`. Each profiled call writes
+collapsed stacks to `profiles/`, which can be merged with `yearn-fees merge-profiles`.
+"""
+
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from itertools import count
+from pathlib import Path
+from time import sleep
+
+PROFILE_ENV = "YEARN_FEES_PROFILE"
+PROFILE_DIR = Path("profiles")
+SAMPLE_INTERVAL = 0.005
+
+_active: ContextVar[bool] = ContextVar("profiling", default=False)
+_counter = count()
+
+
+def enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "") not in ["", "0"]
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """
+    Periodically samples the stack of one thread and counts collapsed stacks.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+            sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path):
+        path.parent.mkdir(exist_ok=True)
+        with path.open("wt") as f:
+            for stack, num in self.stacks.most_common():
+                f.write(f"{stack} {num}\n")
+
+
+def profile(key_func):
+    """
+    Profile a function when profiling is enabled.
+
+    `key_func` receives the call arguments and returns a tx hash for the profile name.
+    Nested profiled calls are captured by the outermost profile.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled() or _active.get():
+                return func(*args, **kwargs)
+
+            try:
+                key = key_func(*args, **kwargs)
+            except Exception:
+                key = "unknown"
+
+            token = _active.set(True)
+            sampler = None
+            try:
+                with Sampler(threading.get_ident()) as sampler:
+                    return func(*args, **kwargs)
+            finally:
+                _active.reset(token)
+                # the sampler thread may have failed to start
+                if sampler is not None:
+                    name = f"{key}.{func.__name__}.{os.getpid()}.{next(_counter)}.collapsed"
+                    sampler.write(PROFILE_DIR / name)
+
+        return wrapper
+
+    return decorator
+
+
+def read_collapsed(path: Path) -> Counter:
+    stacks = Counter()
+    for line in path.read_text().splitlines():
+        stack, _, num = line.rpartition(" ")
+        stacks[stack] += int(num)
+    return stacks
+
+
+def merge_profiles(paths) -> Counter:
+    stacks = Counter()
+    for path in paths:
+        stacks.update(read_collapsed(path))
+    return stacks
+
+
+def to_speedscope(stacks: Counter, name="yearn-fees", interval=SAMPLE_INTERVAL) -> dict:
+    frames = {}
+    samples = []
+    weights = []
+    for stack, num in stacks.items():
+        samples.append([frames.setdefault(item, len(frames)) for item in stack.split(";")])
+        weights.append(num * interval)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": item} for item in frames]},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        ],
+    }
+
+
+def write_merged(pattern="*.collapsed", output="merged.collapsed", speedscope=None):
+    """
+    Merge per-task profiles into one collapsed stacks file and optionally a speedscope file.
+    """
+    paths = sorted(PROFILE_DIR.glob(pattern))
+    stacks = merge_profiles(paths)
+
+    with open(output, "wt") as f:
+        for stack, num in stacks.most_common():
+            f.write(f"{stack} {num}\n")
+
+    if speedscope:
+        with open(speedscope, "wt") as f:
+            json.dump(to_speedscope(stacks), f)
+
+    return paths, stacks
@@ -0,0 +1,192 @@
+"""
+A local json-rpc node which records responses from an upstream node and replays them.
+
+Point the geth provider at it to benchmark the whole pipeline without an archive node.
+In replay mode the responses are served with a configurable latency and bandwidth.
+Responses are streamed through temporary files and stored as files, traces can be gigabytes.
+"""
+
+import hashlib
+import io
+import json
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import BinaryIO, Iterator
+
+import diskcache
+import httpx
+import ijson
+
+RECORDINGS = "replay"
+CHUNK_SIZE = 65_536
+ID_PATTERN = re.compile(rb'"id"\s*:\s*(\d+|"[^"]*")')
+
+
+def request_key(request) -> str:
+    payload = json.dumps([request["method"], request.get("params", [])], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def replace_id(response: bytes, request_id) -> bytes:
+    """
+    Swap the recorded id for the request's id, only looking at the head of a streamed response.
+    """
+    head, tail = response[:128], response[128:]
+    new_id = json.dumps(request_id).encode()
+    return ID_PATTERN.sub(lambda m: b'"id":' + new_id, head, count=1) + tail
+
+
+def error_response(request_id, message) -> "Response":
+    error = {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32000, "message": message}}
+    return Response(io.BytesIO(json.dumps(error).encode()))
+
+
+def is_error(status_code, f: BinaryIO) -> bool:
+    """
+    Check the status and the json-rpc envelope, stopping at the result instead of parsing it.
+    """
+    if status_code != 200:
+        return True
+
+    try:
+        for prefix, event, value in ijson.parse(f):
+            if prefix == "" and event == "map_key" and value in ["result", "error"]:
+                return value == "error"
+        # no result at all
+        return True
+    except ijson.JSONError:
+        return True
+    finally:
+        f.seek(0)
+
+
+class Response:
+    """
+    A response body in a file, with the recorded id swapped for the request's.
+    """
+
+    def __init__(self, f: BinaryIO, request_id=None, swap_id=False):
+        self.file = f
+        head = f.read(128)
+        self.head = replace_id(head, request_id) if swap_id else head
+        self.size = len(self.head) + f.seek(0, io.SEEK_END) - len(head)
+        f.seek(len(head))
+
+    def chunks(self) -> Iterator[bytes]:
+        with self.file:
+            yield self.head
+            yield from iter(lambda: self.file.read(CHUNK_SIZE), b"")
+
+    def read(self) -> bytes:
+        return b"".join(self.chunks())
+
+
+class ReplayNode:
+    """
+    Records or replays json-rpc responses keyed by method and params.
+    """
+
+    def __init__(
+        self,
+        mode="replay",
+        upstream="http://127.0.0.1:8545",
+        path=RECORDINGS,
+        latency=0.0,
+        bandwidth=None,
+        passthrough=False,
+    ):
+        assert mode in ["record", "replay"]
+        self.mode = mode
+        self.upstream = upstream
+        self.recordings = diskcache.Cache(path, size_limit=200_000_000_000)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.passthrough = passthrough
+        self.client = httpx.Client(timeout=600)
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+        self.lock = threading.Lock()
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def fetch(self, request):
+        """
+        Stream an upstream response into a temporary file, returns the status code and the file.
+        """
+        f = tempfile.TemporaryFile()
+        with self.client.stream("POST", self.upstream, json=request) as response:
+            for chunk in response.iter_bytes(CHUNK_SIZE):
+                f.write(chunk)
+        f.seek(0)
+        return response.status_code, f
+
+    def handle(self, request) -> Response:
+        key = request_key(request)
+        if self.mode == "record":
+            status_code, f = self.fetch(request)
+            # don't record errors, they are usually transient
+            if is_error(status_code, f):
+                return Response(f)
+            with f:
+                self.recordings.set(key, f, read=True)
+            self.count("recorded")
+
+        # recordings made before they were stored as files come back as bytes
+        recorded = self.recordings.get(key, read=True)
+        if recorded is not None:
+            if self.mode == "replay":
+                self.count("hits")
+            if isinstance(recorded, bytes):
+                recorded = io.BytesIO(recorded)
+            return Response(recorded, request.get("id"), swap_id=True)
+
+        self.count("misses")
+        if self.passthrough:
+            return Response(self.fetch(request)[1])
+        return error_response(request.get("id"), f"not recorded: {request['method']}")
+
+    def handle_body(self, body: bytes) -> Response:
+        payload = json.loads(body)
+        if isinstance(payload, list):
+            responses = [json.loads(self.handle(request).read()) for request in payload]
+            return Response(io.BytesIO(json.dumps(responses).encode()))
+
+        return self.handle(payload)
+
+    def write(self, wfile, response: Response):
+        """
+        Write a response, throttled to the configured bandwidth in bytes per second.
+        """
+        if self.latency:
+            sleep(self.latency)
+
+        for chunk in response.chunks():
+            wfile.write(chunk)
+            if self.bandwidth:
+                sleep(len(chunk) / self.bandwidth)
+
+    def serve(self, host="127.0.0.1", port=8546):
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["content-length"]))
+                response = node.handle_body(body)
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(response.size))
+                self.end_headers()
+                node.write(self.wfile, response)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
@@ -0,0 +1,175 @@
+"""
+A columnar view of all reports for vectorized filtering and grouping.
+
+Rows are aligned with `utils.fetch_all_reports`, so a mask selects the matching logs.
+Addresses and tx hashes are stored as ids into lookup lists. The arrays are saved to the
+cache directory and memory-mapped on the next run, as long as the reports haven't changed.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from ape.contracts import ContractLog
+
+from yearn_fees.cache import cache
+
+TABLE_PATH = Path(cache.directory) / "report_table"
+COLUMNS = {
+    "block_number": np.int64,
+    "log_index": np.int32,
+    "vault": np.int32,
+    "strategy": np.int32,
+    # only compared to zero, uint256 doesn't fit a native dtype
+    "gain": np.float64,
+    "tx": np.int32,
+}
+
+
+@dataclass
+class ReportTable:
+    block_number: np.ndarray
+    log_index: np.ndarray
+    vault: np.ndarray
+    strategy: np.ndarray
+    gain: np.ndarray
+    tx: np.ndarray
+    vaults: List[str]
+    strategies: List[str]
+    txs: List[str]
+
+    def __len__(self):
+        return len(self.block_number)
+
+    def mask(
+        self, vault=None, strategy=None, block_number=None, only_profitable=False
+    ) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        if vault:
+            mask &= self.vault == lookup_id(self.vaults, vault)
+        if strategy:
+            mask &= self.strategy == lookup_id(self.strategies, strategy)
+        if block_number is not None:
+            mask &= self.block_number == block_number
+        if only_profitable:
+            mask &= self.gain > 0
+
+        return mask
+
+    def duplicated(self, *columns) -> np.ndarray:
+        """
+        Rows whose key made of `columns` occurs at least twice.
+        """
+        keys = np.stack([getattr(self, column) for column in columns], axis=1)
+        _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        return counts[inverse.ravel()] >= 2
+
+    def vault_txs(self, vault) -> List[str]:
+        tx_ids = np.unique(self.tx[self.mask(vault=vault)])
+        return [self.txs[i] for i in tx_ids]
+
+
+def lookup_id(values: List[str], value) -> int:
+    # an unknown value matches no rows
+    return values.index(value) if value in values else -1
+
+
+def build(reports: List[ContractLog]) -> ReportTable:
+    ids = {"vault": {}, "strategy": {}, "tx": {}}
+    columns = {name: np.empty(len(reports), dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    for i, log in enumerate(reports):
+        values = {
+            "vault": log.contract_address,
+            "strategy": log.strategy,
+            "tx": log.transaction_hash.hex(),
+        }
+        for name, value in values.items():
+            columns[name][i] = ids[name].setdefault(value, len(ids[name]))
+        columns["block_number"][i] = log.block_number
+        columns["log_index"][i] = log.log_index
+        columns["gain"][i] = log.gain
+
+    return ReportTable(
+        **columns,
+        vaults=list(ids["vault"]),
+        strategies=list(ids["strategy"]),
+        txs=list(ids["tx"]),
+    )
+
+
+def fingerprint(reports: List[ContractLog]) -> List:
+    # reports are only ever appended to
+    if not reports:
+        return [0]
+    first, last = reports[0], reports[-1]
+    return [len(reports), first.block_number, first.log_index, last.block_number, last.log_index]
+
+
+def save(table: ReportTable, reports: List[ContractLog], path=TABLE_PATH):
+    """
+    Write the arrays first and the lookups last, each with a rename, so concurrent
+    workers never load a partial table.
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    suffix = f".{os.getpid()}.tmp"
+    for name in COLUMNS:
+        tmp = path / f"{name}.npy{suffix}"
+        with open(tmp, "wb") as f:
+            np.save(f, getattr(table, name))
+        os.replace(tmp, path / f"{name}.npy")
+
+    meta = {
+        "fingerprint": fingerprint(reports),
+        "vaults": table.vaults,
+        "strategies": table.strategies,
+        "txs": table.txs,
+    }
+    tmp = path / f"meta.json{suffix}"
+    tmp.write_text(json.dumps(meta))
+    os.replace(tmp, path / "meta.json")
+
+
+def load(reports: List[ContractLog], path=TABLE_PATH) -> Optional[ReportTable]:
+    """
+    Memory-map a saved table if it was built from the same reports.
+    """
+    try:
+        meta = json.loads((path / "meta.json").read_text())
+        if meta["fingerprint"] != fingerprint(reports):
+            return None
+        columns = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in COLUMNS}
+    except (OSError, ValueError):
+        return None
+
+    if any(len(column) != len(reports) for column in columns.values()):
+        return None
+
+    return ReportTable(
+        **columns, vaults=meta["vaults"], strategies=meta["strategies"], txs=meta["txs"]
+    )
+
+
+_table: Optional[ReportTable] = None
+_fingerprint = None
+
+
+def get_report_table(reports: List[ContractLog]) -> ReportTable:
+    """
+    The table for `reports`, kept in memory and memory-mapped from the cache between runs.
+    """
+    global _table, _fingerprint
+
+    if _table is not None and _fingerprint == fingerprint(reports):
+        return _table
+
+    table = load(reports)
+    if table is None:
+        table = build(reports)
+        save(table, reports)
+
+    _table, _fingerprint = table, fingerprint(reports)
+    return table
@@ -0,0 +1,121 @@
+"""
+A persistent dead-letter queue of transactions the indexer has dropped or failed to index.
+
+Each entry is retried with exponential backoff, higher priority first.
+"""
+
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Dict, List, Optional
+
+from yearn_fees.models import DroppedTx, db_session, desc, select
+from yearn_fees.verification import record_verification
+
+BACKOFF_BASE = 60
+BACKOFF_MAX = 86_400
+
+
+class Reason(Enum):
+    mismatch = "mismatch"
+    error = "error"
+    manual = "manual"
+    flagged = "flagged"
+
+
+# mismatches are the most interesting to look at, errors are often transient
+PRIORITY = {
+    Reason.mismatch: 10,
+    Reason.error: 0,
+    Reason.manual: 5,
+    # probable pathological traces go last
+    Reason.flagged: -10,
+}
+
+
+def backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE * 2**attempts, BACKOFF_MAX))
+
+
+def record(
+    tx: str,
+    reason: Reason,
+    error: Optional[str] = None,
+    elapsed: Optional[float] = None,
+    fees: Optional[List[Dict]] = None,
+):
+    """
+    Add a tx to the queue or reschedule it if it's already there.
+    `fees` holds both methods' results for each mismatched report.
+    """
+    now = datetime.now(timezone.utc)
+    with db_session:
+        item = DroppedTx.get(transaction_hash=tx)
+        if item is None:
+            item = DroppedTx(
+                transaction_hash=tx,
+                reason=reason.value,
+                priority=PRIORITY[reason],
+                next_attempt=now,
+                updated=now,
+            )
+        else:
+            item.attempts += 1
+
+        # count a mismatch once, not again on each retry
+        if reason == Reason.mismatch and (item.attempts == 0 or item.reason != reason.value):
+            for report in fees:
+                record_verification(report["version"], mismatch=True)
+
+        # follow the new reason, unless the priority was changed by `enqueue`
+        if item.priority == PRIORITY[Reason(item.reason)]:
+            item.priority = PRIORITY[reason]
+        item.reason = reason.value
+        item.error = error
+        item.elapsed = elapsed
+        item.fees = fees
+        item.resolved = False
+        item.updated = now
+        item.next_attempt = now + backoff(item.attempts)
+
+
+def enqueue(tx: str, priority: Optional[int] = None):
+    """
+    Manually add a tx to the queue so it's picked up on the next retry.
+    """
+    now = datetime.now(timezone.utc)
+    with db_session:
+        item = DroppedTx.get(transaction_hash=tx)
+        if item is None:
+            item = DroppedTx(
+                transaction_hash=tx,
+                reason=Reason.manual.value,
+                priority=PRIORITY[Reason.manual],
+                next_attempt=now,
+                updated=now,
+            )
+        if priority is not None:
+            item.priority = priority
+        item.resolved = False
+        item.next_attempt = now
+
+
+def resolve(tx: str):
+    with db_session:
+        item = DroppedTx.get(transaction_hash=tx)
+        if item is not None and not item.resolved:
+            item.resolved = True
+            item.updated = datetime.now(timezone.utc)
+
+
+def pending(limit: Optional[int] = None, due_only=True) -> List[str]:
+    """
+    Find unresolved txs ordered by priority, optionally only those due for a retry.
+    """
+    now = datetime.now(timezone.utc)
+    with db_session:
+        query = select(item for item in DroppedTx if not item.resolved)
+        if due_only:
+            query = query.filter(lambda item: item.next_attempt <= now)
+        query = query.order_by(lambda item: (desc(item.priority), item.attempts, item.next_attempt))
+        items = query.limit(limit) if limit else query[:]
+        return [item.transaction_hash for item in items]
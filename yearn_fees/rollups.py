@@ -0,0 +1,93 @@
+"""
+Fee rollups per vault, strategy and version at daily and monthly grain.
+
+The indexer adds each report in the same transaction as its insert, `rebuild` recomputes
+them from the reports table. Amounts are in vault tokens, so only vault and strategy
+rollups can be summed meaningfully, version rollups are mostly useful for counts.
+"""
+
+from datetime import datetime, timezone
+
+from yearn_fees.models import Report, db, db_session
+
+SCOPES = ["vault", "strategy", "version"]
+GRAINS = ["day", "month"]
+AMOUNTS = ["gain", "loss", "management_fee", "performance_fee", "strategist_fee"]
+INDEXES = ["vault", "strategy", "timestamp", "transaction_hash"]
+
+
+def truncate(timestamp: datetime, grain) -> datetime:
+    timestamp = timestamp.astimezone(timezone.utc)
+    day = timestamp.day if grain == "day" else 1
+    return datetime(timestamp.year, timestamp.month, day, tzinfo=timezone.utc)
+
+
+def add_report(report: Report):
+    """
+    Add a report to all its rollups, call within the db_session which inserts it.
+    """
+    # upsert to avoid racing with other workers, always in the same order to avoid deadlocks
+    for scope in SCOPES:
+        for grain in GRAINS:
+            values = {
+                "scope": scope,
+                "key": getattr(report, scope),
+                "grain": grain,
+                "period": truncate(report.timestamp, grain),
+                "duration": report.duration,
+                **{amount: getattr(report, amount) for amount in AMOUNTS},
+            }
+            db.execute(
+                """
+                insert into fee_rollups (
+                    scope, key, grain, period, reports, gain, loss,
+                    management_fee, performance_fee, strategist_fee, duration
+                )
+                values (
+                    $scope, $key, $grain, $period, 1, $gain, $loss,
+                    $management_fee, $performance_fee, $strategist_fee, $duration
+                )
+                on conflict (scope, key, grain, period) do update set
+                    reports = fee_rollups.reports + 1,
+                    gain = fee_rollups.gain + excluded.gain,
+                    loss = fee_rollups.loss + excluded.loss,
+                    management_fee = fee_rollups.management_fee + excluded.management_fee,
+                    performance_fee = fee_rollups.performance_fee + excluded.performance_fee,
+                    strategist_fee = fee_rollups.strategist_fee + excluded.strategist_fee,
+                    duration = fee_rollups.duration + excluded.duration
+                """,
+                locals=values,
+            )
+
+
+def create_indexes():
+    """
+    Index the reports table, pony only creates indexes together with the table.
+    """
+    for column in INDEXES:
+        db.execute(f"create index if not exists idx_reports__{column} on reports ({column})")
+
+
+def rebuild():
+    """
+    Recompute all rollups from the reports table in bulk.
+    """
+    with db_session:
+        create_indexes()
+        db.execute("delete from fee_rollups")
+        for scope in SCOPES:
+            for grain in GRAINS:
+                db.execute(f"""
+                    insert into fee_rollups (
+                        scope, key, grain, period, reports, gain, loss,
+                        management_fee, performance_fee, strategist_fee, duration
+                    )
+                    select
+                        '{scope}', {scope}, '{grain}',
+                        date_trunc('{grain}', timestamp at time zone 'UTC') at time zone 'UTC',
+                        count(*), sum(gain), sum(loss),
+                        sum(management_fee), sum(performance_fee), sum(strategist_fee),
+                        sum(duration)
+                    from reports
+                    group by 2, 4
+                    """)
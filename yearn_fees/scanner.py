@@ -1,12 +1,15 @@
+import hashlib
+import json
 from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Literal
+from typing import Dict, List, Literal, Tuple
 
 from pydantic import BaseModel
 from rich import print
 
 from yearn_fees.assess import assess_fees
-from yearn_fees.compare import compare_as_table
+from yearn_fees.cache import cache
+from yearn_fees.compare import cached_results, compare_as_table
 from yearn_fees.memory_layout import MemoryLayout
 from yearn_fees.traces import fees_from_trace
 from yearn_fees.types import TraceFrame
@@ -19,6 +22,9 @@ from yearn_fees.utils import (
     version_from_report,
 )
 
+# bump when splitting or indexing changes, so indexes cached before aren't reused
+VALUE_INDEX_VERSION = 2
+
 
 class MatchedValue(BaseModel):
     loc: Literal["stack", "memory"]
@@ -29,22 +35,63 @@ class MatchedValue(BaseModel):
         frozen = True
 
 
+class ValueIndex(Dict[int, List[Tuple[str, int, int]]]):
+    """
+    An inverted index of a split trace: value -> [(loc, pc, index)].
+    Only includes frames with a non-repeating program counter.
+    """
+
+    @classmethod
+    def from_trace(cls, trace: List[TraceFrame]):
+        index = cls()
+        # drop frames with a repeating program counter
+        counts = Counter(frame.pc for frame in trace)
+
+        for frame in trace:
+            if counts[frame.pc] > 1:
+                continue
+            for loc in ["stack", "memory"]:
+                for i, item in enumerate(getattr(frame, loc)):
+                    if item != 0:
+                        index.setdefault(item, []).append((loc, frame.pc, i))
+
+        return index
+
+    def find(self, value) -> List[MatchedValue]:
+        return [MatchedValue(loc=loc, pc=pc, index=index) for loc, pc, index in self.get(value, [])]
+
+
+def value_index_key(tx, program_counters=None) -> str:
+    key = f"value_index:v{VALUE_INDEX_VERSION}:{tx}"
+    # a trace split at other entry points has different parts
+    if program_counters:
+        pcs = json.dumps(program_counters, sort_keys=True).encode()
+        key += f":{hashlib.sha256(pcs).hexdigest()[:16]}"
+
+    return key
+
+
+def get_value_indexes(tx, traces=None, program_counters=None, reports=None) -> List[ValueIndex]:
+    """
+    Get value indexes for each report in a tx from cache, building them from the split trace.
+    Pass `program_counters` if the trace is split at other than the known entry points.
+    """
+    key = value_index_key(tx, program_counters)
+    indexes = cache.get(key)
+    if indexes is None:
+        if traces is None:
+            traces = get_split_trace(tx, program_counters, reports=reports)
+        indexes = [ValueIndex.from_trace(trace) for trace in traces]
+        cache[key] = indexes
+
+    return indexes
+
+
 def find_value(trace, value) -> List[MatchedValue]:
-    results = []
     if value == 0:
-        return results
-    # drop frames with a repeating program counter
-    counts = Counter(frame.pc for frame in trace)
-
-    for frame in trace:
-        if counts[frame.pc] > 1:
-            continue
-        for loc in ["stack", "memory"]:
-            for index, item in enumerate(getattr(frame, loc)):
-                if item == value:
-                    results.append(MatchedValue(loc=loc, pc=frame.pc, index=index))
+        return []
 
-    return results
+    return ValueIndex.from_trace(trace).find(value)
 
 
 def display_trace(trace: List[TraceFrame], version, fees):
@@ -67,7 +114,7 @@ def layout_tx(tx, only_version=None):
     reports = reports_from_tx(tx)
     print(f"[green]found {len(reports)} reports at {tx}")
 
-    traces = get_split_trace(tx)
+    traces = get_split_trace(tx, reports=reports)
 
     for report, trace in zip(reports, traces):
         version = version_from_report(report)
@@ -84,29 +131,35 @@ def layout_tx(tx, only_version=None):
         display_trace(trace, version, fees)
 
 
-def find_duration_from_tx(tx, version=None, quiet=False):
+def find_field_from_tx(tx, field="duration", version=None, quiet=False):
+    """
+    Find positions where a known fee value appears in the trace of each report.
+    """
     reports = reports_from_tx(tx)
-    traces = get_split_trace(tx)
+    keys = [f"{tx}:{report.log_index}" for report in reports]
+    fees_assess = cached_results("assess", keys, lambda: [assess_fees(r) for r in reports])
+    # the trace is only needed to display the comparison or to build missing indexes
+    traces = None if quiet else get_split_trace(tx)
+    indexes = get_value_indexes(tx, traces)
     results = Counter()
 
-    for i, (report, trace) in enumerate(zip(reports, traces)):
+    for i, (report, fees, index) in enumerate(zip(reports, fees_assess, indexes)):
         vers = version_from_report(report)
         if version and vers != version:
             continue
 
-        decimals = get_decimals(report.contract_address)
-
-        fees_assess = assess_fees(report)
-        duration = fees_assess.duration
-        if duration == 0:
+        value = getattr(fees, field)
+        if not value:
             continue
 
-        print(f"[green]{tx} report {i}")
-        print(f"version {vers}")
-        fees_trace = fees_from_trace(trace, vers)
-        compare_as_table({'assess': fees_assess, 'trace': fees_trace}, decimals)
+        if not quiet:
+            decimals = get_decimals(report.contract_address)
+            print(f"[green]{tx} report {i}")
+            print(f"version {vers}")
+            fees_trace = fees_from_trace(traces[i], vers, tx)
+            compare_as_table({"assess": fees, "trace": fees_trace}, decimals)
 
-        for res in find_value(trace, duration):
+        for res in index.find(value):
             results[res] += 1
 
     if not quiet:
@@ -116,9 +169,9 @@ def find_duration_from_tx(tx, version=None, quiet=False):
     return results
 
 
-def find_duration(version, tx=None, samples=10):
+def find_field(version, field="duration", samples=10):
     """
-    Find non-ambiguous program counters where duration is in memory or on stack.
+    Find non-ambiguous program counters where a fee value is in memory or on stack.
     """
     reports = get_reports()
     vaults = get_vaults_by_version()
@@ -128,7 +181,7 @@ def find_duration(version, tx=None, samples=10):
     results = Counter()
 
     with ThreadPoolExecutor(4) as pool:
-        tasks = [pool.submit(find_duration_from_tx, tx, version, quiet=True) for tx in txs]
+        tasks = [pool.submit(find_field_from_tx, tx, field, version, quiet=True) for tx in txs]
         for future in as_completed(tasks):
             results.update(future.result())
 
@@ -137,3 +190,16 @@ def find_duration(version, tx=None, samples=10):
         if num <= best - 2:
             continue
         print(f"({num}) {res}")
+
+    return results
+
+
+def find_duration_from_tx(tx, version=None, quiet=False):
+    return find_field_from_tx(tx, "duration", version, quiet)
+
+
+def find_duration(version, tx=None, samples=10):
+    """
+    Find non-ambiguous program counters where duration is in memory or on stack.
+    """
+    return find_field(version, "duration", samples)
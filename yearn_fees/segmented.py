@@ -0,0 +1,158 @@
+"""
+Segmented trace retrieval for txs too large for a full `debug_traceTransaction`.
+
+The tx is re-executed with a tracer which only keeps the frames of a vault at the program
+counters `_assessFees` is split and extracted at. There is one segment per vault and completed
+segments are persisted, so a failed tx resumes where it stopped. If the node can't run the
+tracer, the same frames are recovered from a vmTrace.
+"""
+
+import json
+import os
+from typing import Iterable, List, Set
+
+import httpx
+import ijson
+from ape import chain
+from toolz import groupby
+
+from yearn_fees import metrics, node, trace_stream, traces, utils, vmtrace
+from yearn_fees.cache import cache
+from yearn_fees.models import TracePrediction, db_session
+from yearn_fees.types import TraceFrame
+
+SEGMENT_TIMEOUT = int(os.environ.get("YEARN_FEES_SEGMENT_TIMEOUT", 300))
+# errors of a full trace after which the tx is retried in segments
+RETRYABLE = (
+    httpx.TransportError,
+    httpx.HTTPStatusError,
+    ijson.JSONError,
+    trace_stream.TraceError,
+)
+
+TRACER = """{
+    frames: [],
+    pcs: %(pcs)s,
+    address: "%(address)s",
+    step: function(log, db) {
+        var pc = log.getPC();
+        var op = log.op.toString();
+        if (!this.pcs[pc] && op != "LOG2") return;
+        if (toHex(log.contract.getAddress()) != this.address) return;
+        var stack = [];
+        for (var i = log.stack.length() - 1; i >= 0; i--) {
+            stack.push(log.stack.peek(i).toString(16));
+        }
+        var memory = this.pcs[pc] ? toHex(log.memory.slice(0, log.memory.length())) : "0x";
+        this.frames.push({pc: pc, op: op, stack: stack, memory: memory});
+    },
+    fault: function(log, db) {},
+    result: function(ctx, db) { return this.frames; }
+}"""
+
+
+def is_giant(tx) -> bool:
+    """
+    A tx flagged by `yearn-fees plan` as too large for a full trace.
+    """
+    with db_session:
+        prediction = TracePrediction.get(transaction_hash=tx)
+        return bool(prediction and prediction.flagged)
+
+
+def segment_pcs(metadata: Iterable[traces.ReportMetadata]) -> Set[int]:
+    pcs = set()
+    for meta in metadata:
+        pcs.add(meta.jumpdest)
+        if meta.version in traces.EXTRACTORS:
+            pcs |= traces.EXTRACTORS[meta.version].pcs
+
+    return pcs
+
+
+def parse_frame(frame) -> TraceFrame:
+    memory = bytes.fromhex(frame["memory"][2:])
+    return TraceFrame(
+        pc=frame["pc"],
+        op=frame["op"],
+        stack=[int(value, 16) for value in frame["stack"]],
+        memory=[int.from_bytes(memory[i : i + 32], "big") for i in range(0, len(memory), 32)],
+    )
+
+
+@node.needs_node
+def rpc(method, params):
+    payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+    response = httpx.post(chain.provider.uri, json=payload, timeout=SEGMENT_TIMEOUT)
+    response.raise_for_status()
+    return response
+
+
+def trace_segment(tx, address, pcs) -> List[TraceFrame]:
+    """
+    Re-execute a tx keeping only the frames of `address` at `pcs` and LOG2 ops.
+    """
+    key = f"segment:{tx}:{address}"
+    frames = cache.get(key)
+    if frames is None:
+        tracer = TRACER % {
+            "pcs": json.dumps({pc: True for pc in sorted(pcs)}),
+            "address": address.lower(),
+        }
+        options = {"tracer": tracer, "timeout": f"{SEGMENT_TIMEOUT}s"}
+        data = rpc("debug_traceTransaction", [tx, options]).json()
+        if "error" in data:
+            raise ValueError("tracer failed", data["error"])
+        frames = data["result"]
+        cache.set(key, frames, retry=True)
+
+    metrics.add_count("trace_frames", len(frames))
+    return [parse_frame(frame) for frame in frames]
+
+
+def trace_vmtrace(tx, pcs, topics) -> List[TraceFrame]:
+    """
+    Recover the same frames as `trace_segment` from a vmTrace, which is far smaller than
+    a struct log since it only has memory and stack diffs.
+    """
+    key = f"segment:{tx}:vmtrace"
+    frames = cache.get(key)
+    if frames is None:
+        response = rpc("trace_replayTransaction", [tx, ["vmTrace"]])
+        vm = vmtrace.response_decoder.decode(response.content).result.vmTrace
+        frames = [
+            (frame.pc, frame.op, frame.stack, frame.memory)
+            for frame in vmtrace.replay_frames(vm, pcs, topics)
+        ]
+        cache.set(key, frames, retry=True)
+
+    metrics.add_count("trace_frames", len(frames))
+    return [TraceFrame(*frame) for frame in frames]
+
+
+def get_split_trace(tx, reports=None) -> List[List[TraceFrame]]:
+    """
+    Get a trace split by report, re-executing one segment per vault.
+    Falls back to vmTrace if the node can't run the tracer.
+    """
+    if isinstance(tx, bytes):
+        tx = tx.hex()
+    reports = reports if reports is not None else utils.reports_from_tx(tx)
+    metadata = [traces.ReportMetadata.from_report(report) for report in reports]
+
+    try:
+        parts = {}
+        by_vault = groupby(lambda i: metadata[i].vault.address, range(len(metadata)))
+        for address, indexes in by_vault.items():
+            vault_metadata = [metadata[i] for i in indexes]
+            frames = trace_segment(tx, address, segment_pcs(vault_metadata))
+            parts.update(zip(indexes, traces.split_by_metadata(iter(frames), iter(vault_metadata))))
+        split = [parts[i] for i in range(len(metadata)) if i in parts]
+    except (ValueError, *RETRYABLE):
+        metrics.add_count("trace_vmtrace_fallback", 1)
+        topics = {meta.topic for meta in metadata}
+        frames = trace_vmtrace(tx, segment_pcs(metadata), topics)
+        split = traces.split_by_metadata(iter(frames), iter(metadata))
+
+    assert len(reports) == len(split), f"reports={len(reports)} split={len(split)} tx={tx}"
+    return split
@@ -0,0 +1,122 @@
+"""
+Stream `debug_traceTransaction` frames over a compressed transport.
+
+The response is decompressed chunk by chunk and fed into an incremental json parser,
+so the whole body is never buffered. zstd is negotiated if `zstandard` is installed.
+"""
+
+import json
+import zlib
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Iterator
+
+import httpx
+import ijson
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# an error response is small, the start of the body is kept to check for one
+ERROR_PEEK = 65_536
+
+
+class TraceError(Exception):
+    pass
+
+
+def accept_encoding() -> str:
+    return "zstd, gzip" if zstandard else "gzip"
+
+
+def get_decompressor(encoding):
+    """
+    An incremental decompressor for a content-encoding, or None for identity.
+    """
+    encoding = encoding.strip().lower()
+    if encoding in ["gzip", "x-gzip"]:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj()
+    if encoding in ["", "identity"]:
+        return None
+
+    raise ValueError("unsupported content-encoding", encoding)
+
+
+def check_error(head: bytes):
+    """
+    Raise if a response without frames is a json-rpc error.
+    """
+    try:
+        data = json.loads(head)
+    except ValueError:
+        return
+    if isinstance(data, dict) and "error" in data:
+        raise TraceError(data["error"])
+
+
+@dataclass
+class StreamStats:
+    encoding: str = ""
+    bytes_wire: int = 0
+    bytes_raw: int = 0
+    frames: int = 0
+    elapsed: float = 0
+
+    @property
+    def ratio(self):
+        return self.bytes_raw / self.bytes_wire if self.bytes_wire else 0
+
+    @property
+    def wire_throughput(self):
+        return self.bytes_wire / self.elapsed if self.elapsed else 0
+
+    @property
+    def raw_throughput(self):
+        return self.bytes_raw / self.elapsed if self.elapsed else 0
+
+
+def stream_frames(uri, tx, stats: StreamStats = None, timeout=600) -> Iterator[dict]:
+    """
+    Yield raw struct log frames of a tx as they arrive.
+    """
+    stats = stats if stats is not None else StreamStats()
+    payload = {"jsonrpc": "2.0", "id": 1, "method": "debug_traceTransaction", "params": [tx]}
+    headers = {"accept-encoding": accept_encoding()}
+    start = perf_counter()
+
+    with httpx.stream("POST", uri, json=payload, headers=headers, timeout=timeout) as response:
+        response.raise_for_status()
+        stats.encoding = response.headers.get("content-encoding", "")
+        decompressor = get_decompressor(stats.encoding)
+        frames = ijson.sendable_list()
+        parser = ijson.items_coro(frames, "result.structLogs.item")
+        head = bytearray()
+
+        def feed(data):
+            stats.bytes_raw += len(data)
+            if len(head) < ERROR_PEEK:
+                head.extend(data[: ERROR_PEEK - len(head)])
+            parser.send(data)
+
+        for chunk in response.iter_raw():
+            stats.bytes_wire += len(chunk)
+            feed(decompressor.decompress(chunk) if decompressor else chunk)
+            stats.frames += len(frames)
+            stats.elapsed = perf_counter() - start
+            yield from frames
+            del frames[:]
+
+        if decompressor:
+            feed(decompressor.flush())
+        parser.close()
+        stats.frames += len(frames)
+        stats.elapsed = perf_counter() - start
+        if not stats.frames:
+            check_error(bytes(head))
+        yield from frames
@@ -1,5 +1,5 @@
 import dataclasses
-from typing import Iterator, List
+from typing import Dict, FrozenSet, Iterator, List, Optional
 
 from ape import Contract
 from ape.contracts import ContractLog
@@ -8,8 +8,9 @@ from eth_utils import keccak
 from ethpm_types import ContractInstance
 from semantic_version import Version
 
-from yearn_fees import utils
-from yearn_fees.memory_layout import PROGRAM_COUNTERS, MemoryLayout
+from yearn_fees import node, utils
+from yearn_fees.memory_layout import MEMORY_LAYOUT, PROGRAM_COUNTERS
+from yearn_fees.profiling import profile
 from yearn_fees.types import Fees, TraceFrame
 
 
@@ -21,7 +22,8 @@ class ReportMetadata:
     jumpdest: int
 
     @classmethod
-    def from_report(cls, report):
+    @node.needs_node
+    def from_report(cls, report, program_counters=PROGRAM_COUNTERS):
         vault = Contract(report.contract_address)
         version = utils.version_from_report(report)
 
@@ -29,17 +31,26 @@ class ReportMetadata:
             vault=vault,
             version=version,
             topic=decode_single("uint256", keccak(text=vault.StrategyReported.abi.selector)),
-            jumpdest=PROGRAM_COUNTERS[version][0],
+            jumpdest=program_counters[version][0],
         )
 
 
-def split_trace(trace: Iterator[TraceFrame], reports: List[ContractLog]) -> List[List[TraceFrame]]:
+@profile(lambda trace, reports, *args: reports[0].transaction_hash.hex())
+def split_trace(
+    trace: Iterator[TraceFrame], reports: List[ContractLog], program_counters=PROGRAM_COUNTERS
+) -> List[List[TraceFrame]]:
     """
     Splits a trace into chunks covering _assessFees.
     """
-    parts = []
     # we can skip an index if it's an iterator
-    report_metadata = (ReportMetadata.from_report(report) for report in reports)
+    report_metadata = (ReportMetadata.from_report(report, program_counters) for report in reports)
+    return split_by_metadata(trace, report_metadata)
+
+
+def split_by_metadata(
+    trace: Iterator[TraceFrame], report_metadata: Iterator[ReportMetadata]
+) -> List[List[TraceFrame]]:
+    parts = []
     meta = next(report_metadata)
     start = None
 
@@ -49,13 +60,14 @@ def split_trace(trace: Iterator[TraceFrame], reports: List[ContractLog]) -> List
         if start is None and frame.op == "JUMPDEST" and frame.pc == meta.jumpdest:
             start = i
 
-        if start:
+        if start is not None:
             part.append(frame)
 
         # for end this method is not reliable, since the function can terminate early
         # instead, we look for the StrategyReported event
-        if start and frame.op == "LOG2" and meta.topic in frame.stack:
+        if start is not None and frame.op == "LOG2" and meta.topic in frame.stack:
             parts.append(part)
+            part = []
             start = None
             try:
                 meta = next(report_metadata)
@@ -65,76 +77,115 @@ def split_trace(trace: Iterator[TraceFrame], reports: List[ContractLog]) -> List
     return parts
 
 
-def fees_from_trace(trace: List[TraceFrame], version: str) -> Fees:
+@dataclasses.dataclass(frozen=True)
+class ExtractionPlan:
     """
-    Recover fees from trace frames. The trace must be already split.
+    Where to find the fee values in the memory of `_assessFees` for a version.
     The program counters are carefully selected from `yearn-fees layout`.
     """
-    layout = MemoryLayout(trace, version)
-
-    if version == "0.4.3":
-        try:
-            data = layout[21195]
-        except KeyError:
-            data = {"duration": layout[20284]["duration"]}
-
-    elif version == "0.4.2":
-        try:
-            data = layout[21324]
-        except KeyError:
-            data = {"duration": layout[20441]["duration"]}
-
-    elif version == "0.3.5":
-        data = layout[21546]
-        # no accurate way to get duration for 0.3.5
-
-    elif version == "0.3.3":
-        data = layout[20312]
-        try:
-            data["management_fee"] = layout[19835]["governance_fee"]
-            data["performance_fee"] = layout[19846]["governance_fee"] - data["management_fee"]
-        except KeyError:
-            data["management_fee"] = data["governance_fee"]
-            data["performance_fee"] = 0
-        # no accurate way to get duration for 0.3.3
-
-    elif version == "0.3.2":
-        data = layout[17731]
-        try:
-            data["management_fee"] = layout[17253]["governance_fee"]
-            data["performance_fee"] = layout[17264]["governance_fee"] - data["management_fee"]
-        except KeyError:
-            data["management_fee"] = data["governance_fee"]
-            data["performance_fee"] = 0
-        # no accurate way to get duration for 0.3.2
-
-    elif version == "0.3.1":
-        data = layout[16164]
-        try:
-            data["management_fee"] = layout[15686]["governance_fee"]
-            data["performance_fee"] = layout[15697]["governance_fee"] - data["management_fee"]
-        except KeyError:
-            data["management_fee"] = data["governance_fee"]
-            data["performance_fee"] = 0
-        # no accurate way to get duration for 0.3.1
-
-    elif version == "0.3.0":
-        data = layout[16133]
-        try:
-            data["management_fee"] = layout[15655]["governance_fee"]
-            data["performance_fee"] = layout[15666]["governance_fee"] - data["management_fee"]
-        except KeyError:
-            data["management_fee"] = data["governance_fee"]
-            data["performance_fee"] = 0
-        # no accurate way to get duration for 0.3.0
-
-    else:
-        raise NotImplementedError("unsupported version", version)
 
-    fees = Fees.parse_obj(data)
+    # pc where all values are final, it's the last one we need to see
+    final_pc: int
+    # pc reached when the function returns early with no gain, only duration is known there
+    early_return_pc: Optional[int] = None
+    # pre-0.3.5 only store governance_fee, it's first set to the management fee
+    # and then incremented by the performance fee
+    management_fee_pc: Optional[int] = None
+    performance_fee_pc: Optional[int] = None
+
+
+# fmt: off
+EXTRACTION_PLANS = {
+    "0.4.3": ExtractionPlan(final_pc=21195, early_return_pc=20284),
+    "0.4.2": ExtractionPlan(final_pc=21324, early_return_pc=20441),
+    # no accurate way to get duration for 0.3.5 and below
+    "0.3.5": ExtractionPlan(final_pc=21546),
+    "0.3.3": ExtractionPlan(final_pc=20312, management_fee_pc=19835, performance_fee_pc=19846),
+    "0.3.2": ExtractionPlan(final_pc=17731, management_fee_pc=17253, performance_fee_pc=17264),
+    "0.3.1": ExtractionPlan(final_pc=16164, management_fee_pc=15686, performance_fee_pc=15697),
+    "0.3.0": ExtractionPlan(final_pc=16133, management_fee_pc=15655, performance_fee_pc=15666),
+}
+# fmt: on
+
+
+class Extractor:
+    """
+    An extraction plan compiled into a single pass over a split trace.
+    """
+
+    def __init__(self, plan: ExtractionPlan, version: str):
+        self.plan = plan
+        self.version = version
+        layout = MEMORY_LAYOUT[version]["_assessFees"]
+        slots = {name: layout[name] for name in Fees.__fields__ if name in layout}
+        if "governance_fee" in layout:
+            slots["governance_fee"] = layout["governance_fee"]
+
+        # which slots to read at each pc
+        self.reads: Dict[int, Dict[str, int]] = {plan.final_pc: slots}
+        if plan.early_return_pc is not None:
+            self.reads[plan.early_return_pc] = {"duration": layout["duration"]}
+        for pc in [plan.management_fee_pc, plan.performance_fee_pc]:
+            if pc is not None:
+                self.reads[pc] = {"governance_fee": layout["governance_fee"]}
+
+        self.pcs: FrozenSet[int] = frozenset(self.reads)
+
+    def capture(self, trace: List[TraceFrame]) -> Dict[int, Dict[str, int]]:
+        captured = {}
+        for frame in trace:
+            if frame.pc not in self.pcs:
+                continue
+            captured[frame.pc] = {
+                name: frame.memory[pos] if pos < len(frame.memory) else None
+                for name, pos in self.reads[frame.pc].items()
+            }
+            # all the other pcs are reached before the final one
+            if frame.pc == self.plan.final_pc:
+                break
+
+        return captured
+
+    def extract(self, trace: List[TraceFrame]) -> Fees:
+        plan = self.plan
+        captured = self.capture(trace)
+
+        if plan.final_pc in captured:
+            data = captured[plan.final_pc]
+        elif plan.early_return_pc in captured:
+            data = {"duration": captured[plan.early_return_pc]["duration"]}
+        else:
+            raise KeyError(plan.final_pc)
 
-    if Version(version) > Version("0.3.5"):
-        if fees.total_fee > fees.gain:
-            fees.management_fee = fees.gain - fees.performance_fee - fees.strategist_fee
+        if plan.management_fee_pc is not None:
+            try:
+                data["management_fee"] = captured[plan.management_fee_pc]["governance_fee"]
+                data["performance_fee"] = (
+                    captured[plan.performance_fee_pc]["governance_fee"] - data["management_fee"]
+                )
+            except KeyError:
+                data["management_fee"] = data["governance_fee"]
+                data["performance_fee"] = 0
+
+        fees = Fees.parse_obj(data)
+
+        if Version(self.version) > Version("0.3.5"):
+            if fees.total_fee > fees.gain:
+                fees.management_fee = fees.gain - fees.performance_fee - fees.strategist_fee
+
+        return fees
+
+
+EXTRACTORS = {version: Extractor(plan, version) for version, plan in EXTRACTION_PLANS.items()}
+
+
+@profile(lambda trace, version, tx=None: tx or "unknown")
+def fees_from_trace(trace: List[TraceFrame], version: str, tx=None) -> Fees:
+    """
+    Recover fees from trace frames. The trace must be already split.
+    `tx` is only used to name the profile.
+    """
+    if version not in EXTRACTORS:
+        raise NotImplementedError("unsupported version", version)
 
-    return fees
+    return EXTRACTORS[version].extract(trace)
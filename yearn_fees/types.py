@@ -2,9 +2,8 @@ import dataclasses
 from bisect import bisect_right
 from decimal import Decimal
 from pickletools import string1
-from typing import Dict, Iterator, List, Tuple
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
 
-from ape.contracts import ContractLog
 from eth_utils.humanize import humanize_seconds
 from pydantic import BaseModel
 from rich import box
@@ -12,6 +11,10 @@ from rich.console import Console
 from rich.table import Table
 from msgspec import Struct
 
+if TYPE_CHECKING:
+    # ape is slow to import and only needed for annotations here
+    from ape.contracts import ContractLog
+
 
 def asof(stack, needle):
     keys = sorted(stack)
@@ -78,7 +81,7 @@ class FeeHistory(BaseModel):
             strategist_fee=asof(self.strategist_fee[strategy], pos),
         )
 
-    def at_report(self, report: ContractLog):
+    def at_report(self, report: "ContractLog"):
         return self.at_pos((report.block_number, report.log_index), report.strategy)
 
 
@@ -2,27 +2,44 @@ import random
 from collections import defaultdict
 from functools import lru_cache
 from operator import attrgetter
+from time import perf_counter
 from typing import Dict, Iterator, List
 
+import httpx
+import numpy as np
 from ape import Contract, chain
 from ape.contracts import ContractLog
 from ape.types import LogFilter
+from eth_utils import encode_hex, keccak, to_checksum_address
+from ethpm_types.abi import EventABI
+from hexbytes import HexBytes
 from semantic_version import Version
-from toolz import concat, groupby, unique, valfilter
+from toolz import concat, groupby, partition_all, unique
 
-from yearn_fees import traces
+from yearn_fees import archive, metrics, node, report_table, trace_stream, traces
 from yearn_fees.cache import cache
 from yearn_fees.types import FeeConfiguration, FeeHistory, LogPosition, TraceFrame, asof
 
 # sort key for logs/events
 LOG_KEY = attrgetter("block_number", "log_index")
-
-
+# events which make up the fee history of a vault
+FEE_EVENTS = [
+    "UpdateManagementFee",
+    "UpdatePerformanceFee",
+    "StrategyAdded",
+    "StrategyUpdatePerformanceFee",
+    "StrategyMigrated",
+]
+
+
+@archive.offline(lambda archive: (11_000_000, archive.meta["height"], 1_000_000))
+@node.needs_node
 def get_range():
     return 11_000_000, chain.blocks.height, 1_000_000
 
 
 @lru_cache(maxsize=None)
+@node.needs_node
 def get_registry():
     """
     Get the latest vault registry on mainnet.
@@ -30,6 +47,7 @@ def get_registry():
     return Contract("v2.registry.ychad.eth")
 
 
+@archive.offline(lambda archive: archive.meta["vaults_by_version"])
 def get_vaults_by_version() -> Dict[str, List[str]]:
     registry = get_registry()
     vaults = groupby(attrgetter("api_version"), registry.NewVault)
@@ -41,7 +59,9 @@ def get_vaults_by_version() -> Dict[str, List[str]]:
     }
 
 
+@archive.offline(lambda archive, contract: archive.meta["decimals"][contract])
 @cache.memoize()
+@node.needs_node
 def get_decimals(contract) -> int:
     return Contract(contract).decimals()
 
@@ -60,6 +80,7 @@ def get_endorsed_vaults(version=None, flat=False):
     return vaults
 
 
+@node.needs_node
 def vault_selectors(event_name):
     """
     Find all variants of an event selector across all vault versions.
@@ -74,18 +95,44 @@ def vault_selectors(event_name):
     )
 
 
-def fetch_all_reports() -> List[ContractLog]:
+@node.needs_node
+def fetch_vault_events(event_name) -> List[ContractLog]:
     """
-    Fetch all StrategyReported events for all endorsed vaults.
+    Fetch all variants of an event for all endorsed vaults with a single log query.
     """
     vaults = get_endorsed_vaults(flat=True)
-    abis = vault_selectors("StrategyReported")
+    abis = vault_selectors(event_name)
     topics = [[LogFilter.from_event(abi).topic_filter[0] for abi in abis]]
     filt = LogFilter(addresses=vaults, events=abis, topic_filter=topics)
     logs = chain.provider.get_contract_logs(filt)
     return list(logs)
 
 
+@archive.offline(lambda archive: archive.meta["reports"])
+def fetch_all_reports() -> List[ContractLog]:
+    """
+    Fetch all StrategyReported events for all endorsed vaults.
+    """
+    return fetch_vault_events("StrategyReported")
+
+
+@archive.offline(
+    lambda archive: {log.strategy: log.contract_address for log in archive.meta["reports"]}
+)
+@cache.memoize(expire=86_400)
+def get_strategy_vaults() -> Dict[str, str]:
+    """
+    Map each strategy to its vault, including strategies added by a migration.
+    A strategy can't move to another vault, so the mapping is only refreshed for new ones.
+    """
+    strategies = {log.strategy: log.contract_address for log in fetch_vault_events("StrategyAdded")}
+    for log in fetch_vault_events("StrategyMigrated"):
+        strategies[log.newVersion] = log.contract_address
+
+    return strategies
+
+
+@archive.offline(lambda archive, report: archive.meta["versions"][report.contract_address])
 def version_from_report(report: ContractLog):
     """
     Return a cached api version (for endorsed vaults) or read from chain.
@@ -94,33 +141,35 @@ def version_from_report(report: ContractLog):
     try:
         version = next(version for version in vaults if report.contract_address in vaults[version])
     except StopIteration:
+        node.connect()
         version = Contract(report.contract_address).apiVersion()
 
     return version
 
 
 def get_reports(
-    vault: str = None, only_profitable=False, non_matching_fees=False
+    vault: str = None, only_profitable=False, non_matching_fees=False, strategy: str = None
 ) -> List[ContractLog]:
     """
-    Get all vault reports, filtering them by vault, gain, or non-matching performance/strategist fees.
+    Get all vault reports, filtering them by vault, strategy, gain,
+    or non-matching performance/strategist fees.
     """
     reports = fetch_all_reports()
 
-    if vault:
-        reports = [log for log in reports if log.contract_address == vault]
-
-    if only_profitable:
-        reports = [log for log in reports if log.gain > 0]
+    if strategy:
+        vault = vault or get_strategy_vaults().get(strategy)
 
-    if not vault and non_matching_fees:
-        raise NotImplementedError("add a cached strategy to vault mapping first")
+    if vault or strategy or only_profitable:
+        table = report_table.get_report_table(reports)
+        mask = table.mask(vault=vault, strategy=strategy, only_profitable=only_profitable)
+        reports = [reports[i] for i in np.flatnonzero(mask)]
 
     if non_matching_fees:
-        fee_conf = get_vault_fee_history(vault)
+        # a single vault is cheaper to fetch on its own
+        fee_histories = {vault: get_vault_fee_history(vault)} if vault else get_fee_histories()
 
         def non_matching_fee(log):
-            conf = fee_conf.at_report(log)
+            conf = fee_histories[log.contract_address].at_report(log)
             return conf.performance_fee != conf.strategist_fee
 
         reports = [log for log in reports if non_matching_fee(log)]
@@ -132,40 +181,40 @@ def get_sample_txs(version, num_vaults, num_txs):
     """
     Sample a version using several vaults and several txs from each vault.
     """
-    reports = get_reports()
+    table = report_table.get_report_table(get_reports())
     vaults = get_endorsed_vaults(version)
     num_vaults = min(num_vaults, len(vaults))
 
     txs = []
     for vault in random.sample(vaults, num_vaults):
-        vault_txs = list(
-            unique(log.transaction_hash.hex() for log in reports if log.contract_address == vault)
-        )
+        vault_txs = table.vault_txs(vault)
         txs.extend(random.sample(vault_txs, min(num_txs, len(vault_txs))))
 
     return txs
 
 
-def txs_with_multiple_reports():
+def duplicated_reports(key, *columns) -> Dict[object, List[ContractLog]]:
     """
-    Find transactions where multiple reports have happened.
+    Group the reports which share a key with another report, only grouping the matches.
     """
     reports = get_reports()
+    mask = report_table.get_report_table(reports).duplicated(*columns)
+    return groupby(key, [reports[i] for i in np.flatnonzero(mask)])
 
-    return valfilter(
-        lambda logs: len(logs) >= 2, groupby(lambda log: log.transaction_hash, reports)
-    )
+
+def txs_with_multiple_reports():
+    """
+    Find transactions where multiple reports have happened.
+    """
+    return duplicated_reports(lambda log: log.transaction_hash, "tx")
 
 
 def txs_with_multiple_vault_harvests():
     """
     Find transaction with multiple harvests of the same vault.
     """
-    reports = get_reports()
-
-    return valfilter(
-        lambda logs: len(logs) >= 2,
-        groupby(lambda log: (log.transaction_hash, log.contract_address), reports),
+    return duplicated_reports(
+        lambda log: (log.transaction_hash, log.contract_address), "tx", "vault"
     )
 
 
@@ -173,14 +222,13 @@ def txs_with_multiple_strategy_harvests():
     """
     Find transaction with multiple harvests of the same strategy (0 duration).
     """
-    reports = get_reports()
-
-    return valfilter(
-        lambda logs: len(logs) >= 2,
-        groupby(lambda log: (log.transaction_hash, log.strategy), reports),
-    )
+    return duplicated_reports(lambda log: (log.transaction_hash, log.strategy), "tx", "strategy")
 
 
+@archive.offline(
+    lambda archive, report: archive.meta["lifecycle"][report.contract_address, report.strategy]
+)
+@node.needs_node
 def get_lifecycle_history(report: ContractLog) -> Dict[LogPosition, ContractLog]:
     """
     vault last report is set:
@@ -223,28 +271,30 @@ def get_lifecycle_history(report: ContractLog) -> Dict[LogPosition, ContractLog]
     return {key: last_report_updates[key] for key in sorted(last_report_updates)}
 
 
+@archive.offline(lambda archive, block_number: archive.meta["timestamps"][block_number])
+@node.needs_node
+def get_timestamp(block_number) -> int:
+    return chain.blocks[block_number].timestamp
+
+
 def duration_from_report(report: ContractLog) -> int:
     history = get_lifecycle_history(report)
     last_event = asof(history, (report.block_number, report.log_index - 1))
-    return (
-        chain.blocks[report.block_number].timestamp
-        - chain.blocks[last_event.block_number].timestamp
-    )
+    return get_timestamp(report.block_number) - get_timestamp(last_event.block_number)
 
 
-def get_vault_fee_history(vault: str) -> FeeHistory:
-    vault = Contract(vault)
-    management_fee = {LOG_KEY(log): log.managementFee for log in vault.UpdateManagementFee}
-    performance_fee = {LOG_KEY(log): log.performanceFee for log in vault.UpdatePerformanceFee}
+def fee_history_from_events(events: Dict[str, List[ContractLog]]) -> FeeHistory:
+    management_fee = {LOG_KEY(log): log.managementFee for log in events["UpdateManagementFee"]}
+    performance_fee = {LOG_KEY(log): log.performanceFee for log in events["UpdatePerformanceFee"]}
     strategist_fee = defaultdict(dict)
     # strategy performance fee is set on init
-    for log in vault.StrategyAdded:
+    for log in events["StrategyAdded"]:
         strategist_fee[log.strategy][LOG_KEY(log)] = log.performanceFee
     # on update strategy fee
-    for log in vault.StrategyUpdatePerformanceFee:
+    for log in events["StrategyUpdatePerformanceFee"]:
         strategist_fee[log.strategy][LOG_KEY(log)] = log.performanceFee
-    # and is also inherited on migration
-    for log in vault.StrategyMigrated:
+    # and is also inherited on migration, which must be applied in order
+    for log in sorted(events["StrategyMigrated"], key=LOG_KEY):
         strategist_fee[log.newVersion][LOG_KEY(log)] = asof(
             strategist_fee[log.oldVersion], LOG_KEY(log)
         )
@@ -256,6 +306,28 @@ def get_vault_fee_history(vault: str) -> FeeHistory:
     )
 
 
+@archive.offline(lambda archive, vault: archive.meta["fee_histories"][vault])
+@node.needs_node
+def get_vault_fee_history(vault: str) -> FeeHistory:
+    vault = Contract(vault)
+    return fee_history_from_events({name: list(getattr(vault, name)) for name in FEE_EVENTS})
+
+
+@archive.offline(lambda archive: archive.meta["fee_histories"])
+def get_fee_histories() -> Dict[str, FeeHistory]:
+    """
+    Fee histories of all vaults with one log query per event instead of one per vault.
+    """
+    events = {
+        name: groupby(attrgetter("contract_address"), fetch_vault_events(name))
+        for name in FEE_EVENTS
+    }
+    return {
+        vault: fee_history_from_events({name: events[name].get(vault, []) for name in FEE_EVENTS})
+        for vault in get_endorsed_vaults(flat=True)
+    }
+
+
 def get_fee_config_at_report(report: ContractLog) -> FeeConfiguration:
     """
     A more accurate method to get fee configuration.
@@ -267,46 +339,155 @@ def get_fee_config_at_report(report: ContractLog) -> FeeConfiguration:
     return fee_conifg.at_report(report)
 
 
+@node.needs_node
 def get_trace(tx) -> Iterator[TraceFrame]:
+    if archive.get_archive():
+        raise NotImplementedError("full traces are not archived, use get_split_trace")
     if isinstance(tx, bytes):
         tx = tx.hex()
 
-    frames = chain.provider.stream_request("debug_traceTransaction", [tx], "result.structLogs.item")
-    for frame in frames:
-        yield TraceFrame.parse(frame)
-
-
-def get_split_trace(tx) -> List[List[TraceFrame]]:
+    stats = trace_stream.StreamStats()
+    frames = trace_stream.stream_frames(chain.provider.uri, tx, stats)
+    # split the time spent waiting on the stream and parsing the frames
+    fetch_time = parse_time = 0
+    num_frames = 0
+    start = perf_counter()
+    try:
+        for frame in frames:
+            parse_start = perf_counter()
+            fetch_time += parse_start - start
+            parsed = TraceFrame.parse(frame)
+            parse_time += perf_counter() - parse_start
+            num_frames += 1
+            yield parsed
+            # the consumer's work between frames is not part of the fetch
+            start = perf_counter()
+    finally:
+        # the consumer can stop early, e.g. `split_trace` after the last report
+        metrics.add_time("trace_fetch", fetch_time)
+        metrics.add_time("trace_parse", parse_time)
+        metrics.add_count("trace_frames", num_frames)
+        # compressed vs decompressed size, throughput follows from `trace_fetch`
+        metrics.add_count("trace_bytes_wire", stats.bytes_wire)
+        metrics.add_count("trace_bytes_raw", stats.bytes_raw)
+
+
+@archive.offline(lambda archive, tx, *args, **kwargs: archive.split_trace(tx))
+def get_split_trace(tx, program_counters=None, reports=None) -> List[List[TraceFrame]]:
+    """
+    Get a trace split by report, `program_counters` can override the known entry points.
+    Pass `reports` if the caller already has them. Archived traces are always split at
+    the known entry points.
+    """
     if isinstance(tx, bytes):
         tx = tx.hex()
     trace = get_trace(tx)
-    reports = reports_from_tx(tx)
-    split = traces.split_trace(trace, reports)
+    reports = reports if reports is not None else reports_from_tx(tx)
+    if program_counters:
+        split = traces.split_trace(trace, reports, program_counters)
+    else:
+        split = traces.split_trace(trace, reports)
     assert len(reports) == len(split), f"reports={len(reports)} split={len(split)} tx={tx}"
 
     return split
 
 
+@cache.memoize(expire=86_400)
+def report_abis() -> Dict[str, EventABI]:
+    """
+    All StrategyReported variants by topic0. Expires daily to pick up new vault versions.
+    """
+    return {
+        encode_hex(keccak(text=abi.selector)): abi for abi in vault_selectors("StrategyReported")
+    }
+
+
+@node.needs_node
+def decode_reports(logs) -> List[ContractLog]:
+    """
+    Decode all StrategyReported variants in a single pass over the logs of a receipt.
+    """
+    abis = report_abis()
+    ecosystem = chain.provider.network.ecosystem
+    by_topic = groupby(lambda log: encode_hex(log["topics"][0]) if log["topics"] else None, logs)
+    reports = []
+    for topic, topic_logs in by_topic.items():
+        if topic in abis:
+            reports.extend(ecosystem.decode_logs(abis[topic], topic_logs))
+
+    return sorted(reports, key=LOG_KEY)
+
+
+@archive.offline(lambda archive, tx: archive.tx(tx)["reports"])
 @cache.memoize()
+@node.needs_node
 def reports_from_tx(tx) -> List[ContractLog]:
-    logs = []
     receipt = chain.provider.get_transaction(tx)
-    for event in vault_selectors("StrategyReported"):
-        logs.extend(receipt.decode_logs(event))
+    return decode_reports(receipt.logs)
 
-    reports = sorted(logs, key=LOG_KEY)
 
-    return reports
+def format_log(log) -> Dict:
+    """
+    Convert a raw json-rpc log into the shape web3 returns.
+    """
+    return {
+        **log,
+        "address": to_checksum_address(log["address"]),
+        "topics": [HexBytes(topic) for topic in log["topics"]],
+        "data": HexBytes(log["data"]),
+        "blockHash": HexBytes(log["blockHash"]),
+        "transactionHash": HexBytes(log["transactionHash"]),
+        "blockNumber": int(log["blockNumber"], 16),
+        "logIndex": int(log["logIndex"], 16),
+        "transactionIndex": int(log["transactionIndex"], 16),
+    }
 
 
-def reports_from_block(block_number, vault=None, strategy=None) -> List[ContractLog]:
-    reports = [log for log in get_reports() if log.block_number == block_number]
-    if vault:
-        reports = [log for log in reports if log.contract_address == vault]
-    if strategy:
-        reports = [log for log in reports if log.strategy == strategy]
+@node.needs_node
+def fetch_receipts(txs) -> Dict[str, Dict]:
+    """
+    Fetch many raw receipts with a single json-rpc batch.
+    """
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": "eth_getTransactionReceipt", "params": [tx]}
+        for i, tx in enumerate(txs)
+    ]
+    response = httpx.post(chain.provider.uri, json=payload, timeout=600)
+    response.raise_for_status()
+    results = {item["id"]: item.get("result") for item in response.json()}
 
-    return reports
+    return {tx: results[i] for i, tx in enumerate(txs) if results.get(i)}
+
+
+def fetch_receipt_logs(txs) -> Dict[str, List[Dict]]:
+    """
+    Fetch the logs of many receipts with a single json-rpc batch.
+    """
+    return {
+        tx: [format_log(log) for log in receipt["logs"]]
+        for tx, receipt in fetch_receipts(txs).items()
+    }
+
+
+def prefetch_reports(txs, chunk_size=100):
+    """
+    Fill the `reports_from_tx` cache for many txs, fetching receipts in batches.
+    """
+    if archive.get_archive():
+        return
+
+    missing = [tx for tx in txs if reports_from_tx.__cache_key__(tx) not in cache]
+    for chunk in partition_all(chunk_size, missing):
+        for tx, logs in fetch_receipt_logs(chunk).items():
+            cache.set(reports_from_tx.__cache_key__(tx), decode_reports(logs), retry=True)
+
+
+def reports_from_block(block_number, vault=None, strategy=None) -> List[ContractLog]:
+    reports = get_reports()
+    mask = report_table.get_report_table(reports).mask(
+        vault=vault, strategy=strategy, block_number=block_number
+    )
+    return [reports[i] for i in np.flatnonzero(mask)]
 
 
 def plural(word, num):
@@ -0,0 +1,117 @@
+"""
+Verification policy for the indexer.
+
+By default both methods run for every report and mismatches are dropped. Versions with a long
+reconciled track record can use a single method or only verify a random sample of reports.
+"""
+
+import dataclasses
+import random
+from enum import Enum
+from typing import Dict, Tuple
+
+import click
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from yearn_fees.memory_layout import MEMORY_LAYOUT
+from yearn_fees.models import VersionStats, db, db_session, select
+
+
+class Mode(Enum):
+    strict = "strict"
+    trace = "trace"
+    assess = "assess"
+    sample = "sample"
+
+
+class Method(Enum):
+    assess = "assess"
+    trace = "trace"
+
+
+def trace_has_duration(version) -> bool:
+    return "duration" in MEMORY_LAYOUT[version]["_assessFees"]
+
+
+@dataclasses.dataclass
+class VerificationPolicy:
+    mode: Mode = Mode.strict
+    sample_rate: int = 10
+    versions: Dict[str, Tuple[Mode, int]] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, mode="strict", sample_rate=10, overrides=()):
+        """
+        Parse a policy from cli options. Overrides look like `0.4.3=trace` or `0.4.2=sample:50`.
+        """
+        modes = [mode.value for mode in Mode]
+        versions = {}
+        for item in overrides:
+            version, _, spec = item.partition("=")
+            name, _, rate = spec.partition(":")
+            if version not in MEMORY_LAYOUT:
+                raise click.BadParameter(
+                    f"unknown version {version!r} in {item!r}", param_hint="--verify-version"
+                )
+            if name not in modes or (rate and not (rate.isdigit() and int(rate) >= 1)):
+                raise click.BadParameter(
+                    f"expected <version>=<{'|'.join(modes)}>[:<rate>], got {item!r}",
+                    param_hint="--verify-version",
+                )
+            versions[version] = (Mode(name), int(rate) if rate else sample_rate)
+
+        return cls(mode=Mode(mode), sample_rate=sample_rate, versions=versions)
+
+    def plan(self, version) -> Tuple[bool, bool]:
+        """
+        Decide which methods to run for a report, returns (run_assess, run_trace).
+        """
+        mode, rate = self.versions.get(version, (self.mode, self.sample_rate))
+
+        # these versions can't get a duration from trace, so assess must run too
+        if mode == Mode.trace and not trace_has_duration(version):
+            mode = Mode.strict
+
+        if mode == Mode.sample:
+            mode = Mode.strict if random.randrange(rate) == 0 else Mode.assess
+
+        return mode in [Mode.strict, Mode.assess], mode in [Mode.strict, Mode.trace]
+
+
+STRICT = VerificationPolicy()
+
+
+def record_verification(version, mismatch: bool):
+    # upsert to avoid racing with other workers
+    verified = 1
+    mismatched = int(mismatch)
+    db.execute("""
+        insert into version_stats (version, verified, mismatched)
+        values ($version, $verified, $mismatched)
+        on conflict (version) do update set
+            verified = version_stats.verified + excluded.verified,
+            mismatched = version_stats.mismatched + excluded.mismatched
+        """)
+
+
+def show_stats():
+    """
+    Display mismatch rates per version.
+    """
+    table = Table(box=box.SIMPLE)
+    table.add_column("version")
+    table.add_column("verified", justify="right")
+    table.add_column("mismatched", justify="right")
+    table.add_column("rate", justify="right")
+
+    with db_session:
+        for stats in select(stats for stats in VersionStats).order_by(VersionStats.version):
+            rate = stats.mismatched / stats.verified if stats.verified else 0
+            table.add_row(
+                stats.version, f"{stats.verified:,d}", f"{stats.mismatched:,d}", f"{rate:.2%}"
+            )
+
+    console = Console()
+    console.print(table)
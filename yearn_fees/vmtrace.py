@@ -12,7 +12,7 @@ References:
 
 from __future__ import annotations
 
-from typing import Any, List, Optional, Type
+from typing import Any, Iterator, List, Optional, Set, Type
 
 import msgspec
 import rich
@@ -22,6 +22,8 @@ from eth_abi import decode_single, encode_single
 from eth_utils import decode_hex, encode_hex
 from hexbytes import HexBytes
 
+from yearn_fees.types import TraceFrame
+
 
 # fmt: off
 # opcodes grouped by number of items they pop from the stack
@@ -193,5 +195,62 @@ def display(vm: VMTrace, offset=0, compare=None, call_target=None):
     rich.print(storage)
 
 
+def replay_frames(vm: VMTrace, pcs: Set[int], topics: Set[int]) -> Iterator[TraceFrame]:
+    """
+    Recover struct log frames at `pcs` and at LOG2 ops emitting one of `topics`.
+
+    Other contracts can reach the same pcs, so only the frames of calls which emit
+    one of the topics are kept. Frames are in execution order, like in a struct log.
+    """
+    yield from call_frames(vm, pcs, topics)
+
+
+def call_frames(vm: VMTrace, pcs: Set[int], topics: Set[int]) -> List[TraceFrame]:
+    memory = Memory()
+    stack = Stack()
+    # (own, frame), the kept frames of subcalls are placed where the subcall happens
+    frames = []
+    emitted = False
+
+    for op in vm.ops:
+        if op.pc in pcs or op.op == "LOG2":
+            values = [value for _, value in stack.values]
+            emitted |= op.op == "LOG2" and bool(topics.intersection(values))
+            data = memory.read_bytes(0, len(memory))
+            words = [int.from_bytes(data[i : i + 32], "big") for i in range(0, len(data), 32)]
+            frames.append((True, TraceFrame(pc=op.pc, op=op.op, stack=values, memory=words)))
+
+        # the op has failed and the call reverts
+        if op.ex is None:
+            break
+
+        if num_pop := POPCODES.get(op.op):
+            stack.pop_ints(num_pop)
+
+        for item in op.ex.push:
+            stack.push_int(item)
+
+        if op.ex.mem:
+            memory.extend(op.ex.mem.off, len(op.ex.mem.data))
+            memory.write(op.ex.mem.off, len(op.ex.mem.data), op.ex.mem.data)
+
+        if op.sub:
+            frames.extend((False, frame) for frame in call_frames(op.sub, pcs, topics))
+
+    # whether this call's own frames are kept is only known once it has finished
+    return [frame for own, frame in frames if emitted or not own]
+
+
+class ReplayResult(msgspec.Struct):
+    vmTrace: VMTrace
+
+
+class ReplayResponse(msgspec.Struct):
+    """A `trace_replayTransaction` response, other fields are ignored."""
+
+    result: ReplayResult
+
+
 decoder = msgspec.json.Decoder(VMTrace, dec_hook=dec_hook)
+response_decoder = msgspec.json.Decoder(ReplayResponse, dec_hook=dec_hook)
 encoder = msgspec.json.Encoder(enc_hook=enc_hook)